@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+from config import Config
+
+
+BINS = np.arange(256, dtype=np.float64)
+
+
+def otsu_threshold(histogram):
+    # Maximise between-class variance over every possible split. Returns the
+    # split and the gap between the two class means, or None when there is
+    # nothing to split (a single grey level).
+    weight_dark = np.cumsum(histogram)
+    weight_light = weight_dark[-1] - weight_dark
+    cumulative_mean = np.cumsum(histogram * BINS)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_dark = cumulative_mean / weight_dark
+        mean_light = (cumulative_mean[-1] - cumulative_mean) / weight_light
+        variance = weight_dark * weight_light * (mean_dark - mean_light) ** 2
+    if np.isnan(variance).all():
+        return None
+    split = int(np.nanargmax(variance))
+    return split, mean_light[split] - mean_dark[split]
+
+
+def percentile_threshold(histogram, percentile):
+    cumulative = np.cumsum(histogram)
+    return int(np.searchsorted(cumulative, cumulative[-1] * percentile / 100))
+
+
+# Tracks a decaying grey-level histogram of the search area, refreshed every
+# HISTOGRAM_UPDATE_INTERVAL frames, and derives the threshold from it. That is
+# a 256-bin calculation instead of an adaptive filter over every pixel.
+class AdaptiveThreshold:
+    def __init__(self):
+        self.histogram = None
+        self.value = Config.THRESHOLD_VALUE
+        self.frames = 0
+
+    def update(self, gray):
+        if Config.THRESHOLD_MODE == "fixed":
+            self.value = Config.THRESHOLD_VALUE
+            return self.value
+
+        self.frames += 1
+        if self.histogram is not None and (
+            self.frames % Config.HISTOGRAM_UPDATE_INTERVAL
+        ):
+            return self.value
+
+        histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+        histogram /= histogram.sum()
+        if self.histogram is None:
+            self.histogram = histogram
+        else:
+            self.histogram *= Config.HISTOGRAM_DECAY
+            self.histogram += (1 - Config.HISTOGRAM_DECAY) * histogram
+
+        split = otsu_threshold(self.histogram)
+        if split is None or split[1] < Config.THRESHOLD_MIN_CONTRAST:
+            # Nothing dark stands out (a covered lens, bare floor), so there
+            # is no threshold to find; keep the last one
+            return self.value
+
+        if Config.THRESHOLD_MODE == "percentile":
+            value = percentile_threshold(self.histogram, Config.THRESHOLD_PERCENTILE)
+        else:
+            value = split[0]
+
+        self.value = min(max(value, Config.THRESHOLD_MIN), Config.THRESHOLD_MAX)
+        return self.value
@@ -0,0 +1,376 @@
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+
+import cv2
+import numpy as np
+from config import Config
+from frame_channel import encode_jpeg
+from frame_source import create_frame_source
+from image_processor import ImageProcessor
+from robot_controller import PIDController, RobotController
+
+SUITE_RESOLUTIONS = [(160, 120), (320, 240), (640, 480)]
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+
+# Runs the robot on replayed frames; argv is the frame file and server port
+STARTUP_SCRIPT = """
+import sys
+from config import Config
+Config.FRAME_SOURCE = "npy"
+Config.FRAME_SOURCE_PATH = sys.argv[1]
+Config.REPLAY_MODE = "native"
+Config.REPLAY_LOOP = True
+Config.SERVER_PORT = int(sys.argv[2])
+import main
+main.main()
+"""
+
+
+def synthetic_frames(count, resolution=None, seed=0, speckle=0.0):
+    # Light floor with a dark line that sweeps and bends across the view.
+    # speckle is the fraction of pixels turned into dark dirt on the floor.
+    width, height = resolution or Config.CAMERA_RESOLUTION
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(count):
+        frame = np.full((height, width, 3), 200, dtype=np.uint8)
+        top_x = int(width / 2 + width / 4 * np.sin(i / 10))
+        mid_x = int(width / 2 + width / 8 * np.sin(i / 7))
+        points = np.array([[top_x, 0], [mid_x, height // 2], [width // 2, height]])
+        cv2.polylines(frame, [points], False, (20, 20, 20), max(4, width // 25))
+        noise = rng.integers(-20, 20, frame.shape, dtype=np.int16)
+        frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+        if speckle:
+            frame[rng.random((height, width)) < speckle] = 30
+        frames.append(frame)
+    return frames
+
+
+def load_frames(source_type, path, limit):
+    source = create_frame_source(source_type, path, replay_mode="fast", loop=False)
+    source.start()
+    try:
+        frames = []
+        for frame in source:
+            frames.append(frame)
+            if len(frames) >= limit:
+                break
+        return frames
+    finally:
+        source.stop()
+
+
+def run_detector(frames, mode, repeat):
+    results = [ImageProcessor.process_frame(frame, mode) for frame in frames]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            ImageProcessor.process_frame(frame, mode)
+    elapsed = time.perf_counter() - start
+    return results, len(frames) * repeat / elapsed
+
+
+def compare_detectors(frames, repeat=10):
+    contour, contour_fps = run_detector(frames, "contour", repeat)
+    scanline, scanline_fps = run_detector(frames, "scanline", repeat)
+
+    both = [
+        (a.x, b.x)
+        for a, b in zip(contour, scanline)
+        if a.x is not None and b.x is not None
+    ]
+    diff = np.abs(np.diff(np.array(both), axis=1)) if both else np.array([0])
+
+    print(f"{'detector':>10} {'fps':>10} {'us/frame':>10} {'found':>8}")
+    for name, results, fps in (
+        ("contour", contour, contour_fps),
+        ("scanline", scanline, scanline_fps),
+    ):
+        found = sum(result.x is not None for result in results)
+        print(f"{name:>10} {fps:>10.0f} {1e6 / fps:>10.1f} {found:>5}/{len(frames)}")
+    print(f"Mean |x difference|: {diff.mean():.1f} px (max {diff.max():.0f})")
+
+
+def ops_per_second(func, items, min_time=0.2, rounds=5):
+    # Best of several rounds, each cycling through items for at least
+    # min_time; the best round is the one least disturbed by the rest of
+    # the system
+    best = 0.0
+    for _ in range(rounds):
+        count = 0
+        start = time.perf_counter()
+        while True:
+            for item in items:
+                func(item)
+            count += len(items)
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, count / elapsed)
+    return best
+
+
+def allocated_per_op(func, items):
+    # Peak memory allocated during one call, averaged. NumPy arrays (and so
+    # every image cv2 returns) are counted; OpenCV's internal scratch isn't.
+    tracemalloc.start()
+    try:
+        total = 0
+        for item in items:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            func(item)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / len(items)
+
+
+def startup_time(frames_path, rounds=3, timeout=60.0):
+    # Seconds from launching the robot on replayed frames to /ready, i.e. the
+    # first motor command based on a frame, interpreter start included. Best
+    # of rounds, each a fresh process.
+    best = None
+    for _ in range(rounds):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-c", STARTUP_SCRIPT, frames_path, str(port)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            while time.perf_counter() - start < timeout:
+                if process.poll() is not None:
+                    raise RuntimeError("Robot exited during startup")
+                try:
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1)
+                    break
+                except (urllib.error.URLError, ConnectionError):
+                    time.sleep(0.005)
+            else:
+                raise RuntimeError(f"Not ready after {timeout:.0f} s")
+            elapsed = time.perf_counter() - start
+        finally:
+            process.terminate()
+            process.wait()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def suite_cases(frame_sets):
+    # Name -> (function, inputs). Detection results feed the rendering
+    # cases so each stage sees what it would in the pipeline.
+    cases = {}
+    for label, frames in frame_sets.items():
+        detections = [ImageProcessor.process_frame(frame) for frame in frames]
+        rendered = [
+            (frame, line_data, frame.shape[1] / 2 - (line_data.x or 0))
+            for frame, line_data in zip(frames, detections)
+        ]
+        debug_frames = [
+            ImageProcessor.create_debug_frame(frame, line_data, error, 50, 50)
+            for frame, line_data, error in rendered
+        ]
+
+        cases[f"process_frame.contour@{label}"] = (
+            lambda frame: ImageProcessor.process_frame(frame, "contour"),
+            frames,
+        )
+        cases[f"process_frame.scanline@{label}"] = (
+            lambda frame: ImageProcessor.process_frame(frame, "scanline"),
+            frames,
+        )
+        cases[f"create_debug_frame@{label}"] = (
+            lambda args: ImageProcessor.create_debug_frame(*args, 50, 50),
+            rendered,
+        )
+        cases[f"jpeg_encode@{label}"] = (encode_jpeg, debug_frames)
+
+    width = Config.CAMERA_RESOLUTION[0]
+    positions = [None] + list(np.linspace(0, width, 64))
+    pid = PIDController()
+    cases["calculate_motor_speeds"] = (
+        lambda x: RobotController.calculate_motor_speeds(width, x),
+        positions,
+    )
+    cases["calculate_pid_speeds"] = (
+        lambda x: RobotController.calculate_pid_speeds(pid, width, x, 0.02),
+        positions,
+    )
+    return cases
+
+
+def machine_info():
+    return {
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+def run_suite(frame_sets, baseline_path, save, threshold, startup=True):
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            stored = json.load(f)
+        baseline = stored["results"]
+        if stored["machine"] != machine_info():
+            print(f"Note: baseline was recorded on {stored['machine']}")
+
+    results = {}
+    regressions = []
+    print(f"{'case':<32} {'ops/s':>10} {'us/op':>9} {'KB/op':>8} {'vs base':>8}")
+    for name, (func, items) in suite_cases(frame_sets).items():
+        ops = ops_per_second(func, items)
+        allocated = allocated_per_op(func, items)
+        results[name] = {"ops_per_sec": ops, "alloc_bytes": allocated}
+
+        change = ""
+        if name in baseline:
+            base = baseline[name]
+            ratio = ops / base["ops_per_sec"]
+            change = f"{(ratio - 1) * 100:+.0f}%"
+            if ratio < 1 - threshold:
+                regressions.append(f"{name}: {ratio:.2f}x baseline speed")
+            # A kilobyte of slack so tiny allocations don't trip it
+            if allocated > base["alloc_bytes"] * (1 + threshold) + 1024:
+                regressions.append(
+                    f"{name}: {allocated / 1024:.1f} KB/op, baseline "
+                    f"{base['alloc_bytes'] / 1024:.1f} KB/op"
+                )
+        print(
+            f"{name:<32} {ops:>10.0f} {1e6 / ops:>9.1f} "
+            f"{allocated / 1024:>8.1f} {change:>8}"
+        )
+
+    if startup:
+        with tempfile.TemporaryDirectory() as directory:
+            frames_path = os.path.join(directory, "frames.npy")
+            np.save(frames_path, np.stack(synthetic_frames(30)))
+            seconds = startup_time(frames_path)
+        results["startup"] = {"seconds": seconds}
+
+        change = ""
+        if "startup" in baseline:
+            ratio = seconds / baseline["startup"]["seconds"]
+            change = f"{(ratio - 1) * 100:+.0f}%"
+            if ratio > 1 + threshold:
+                regressions.append(f"startup: {ratio:.2f}x baseline time")
+        print(
+            f"{'startup.first_motor_command':<32} {'':>10} {seconds * 1e6:>9.0f} "
+            f"{'':>8} {change:>8}"
+        )
+
+    if save:
+        with open(baseline_path, "w") as f:
+            json.dump({"machine": machine_info(), "results": results}, f, indent=2)
+        print(f"Saved baseline to {baseline_path}")
+    elif not baseline:
+        print(f"No baseline at {baseline_path}; run with --save-baseline")
+
+    if regressions:
+        print(f"\nRegressed by more than {threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+    return not regressions
+
+
+def parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the contour and scanline line detectors, or with "
+        "--suite benchmark every hot path against a stored baseline"
+    )
+    parser.add_argument(
+        "source", nargs="?", choices=["images", "video", "npy", "recording"]
+    )
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--speckle", type=float, default=0.0, help="Synthetic floor dirt fraction"
+    )
+    parser.add_argument(
+        "--luma", action="store_true", help="Feed single-channel grey frames"
+    )
+    parser.add_argument(
+        "--suite", action="store_true", help="Run the regression benchmark suite"
+    )
+    parser.add_argument(
+        "--resolutions",
+        type=lambda text: [parse_resolution(r) for r in text.split(",")],
+        default=SUITE_RESOLUTIONS,
+        help="Synthetic frame sizes for --suite, e.g. 160x120,320x240",
+    )
+    parser.add_argument(
+        "--no-startup",
+        action="store_true",
+        help="Skip timing startup to the first motor command",
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="Store results as the baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Fail when a case is this much slower or allocates this much more",
+    )
+    args = parser.parse_args()
+
+    if args.suite:
+        count = min(args.frames, 50)
+        frame_sets = {
+            f"{width}x{height}": synthetic_frames(
+                count, (width, height), speckle=args.speckle
+            )
+            for width, height in args.resolutions
+        }
+        if args.source:
+            frame_sets["recorded"] = load_frames(args.source, args.path, count)
+        if args.luma:
+            frame_sets = {
+                label: [ImageProcessor.to_gray(frame) for frame in frames]
+                for label, frames in frame_sets.items()
+            }
+        ok = run_suite(
+            frame_sets,
+            args.baseline,
+            args.save_baseline,
+            args.threshold,
+            not args.no_startup,
+        )
+        sys.exit(0 if ok else 1)
+
+    if args.source:
+        frames = load_frames(args.source, args.path, args.frames)
+    else:
+        frames = synthetic_frames(args.frames, speckle=args.speckle)
+    if args.luma:
+        frames = [ImageProcessor.to_gray(frame) for frame in frames]
+    compare_detectors(frames, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
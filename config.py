@@ -1,45 +1,130 @@
-import threading
+from frame_channel import FrameChannel
+from snapshot import ControlInput, FrameSnapshot, Published
 
 
 class Config:
     # Camera settings
     CAMERA_RESOLUTION = (320, 240)
-    CAMERA_FORMAT = "RGB888"
+    CAMERA_FORMAT = "RGB888"  # "YUV420" processes the luma (Y) plane only
     CAMERA_FPS = 10  # 1/0.0001 seconds
 
+    # Frame source settings
+    FRAME_SOURCE = "camera"  # "camera", "images", "video", "npy" or "recording"
+    FRAME_SOURCE_PATH = None  # PNG directory, video file, .npy stack or recording
+    REPLAY_MODE = "native"  # "native", "fixed" (REPLAY_FPS) or "fast"
+    REPLAY_FPS = 10
+    REPLAY_LOOP = False
+
     # Processing settings
-    THRESHOLD_VALUE = 127
+    THRESHOLD_VALUE = 127  # Used as is in "fixed" mode, as a start otherwise
+    THRESHOLD_MODE = "fixed"  # "fixed", "otsu" or "percentile"
+    THRESHOLD_PERCENTILE = 3  # % of the search area, under the share the line covers
+    THRESHOLD_MIN = 40  # Clamp for the adaptive modes
+    THRESHOLD_MAX = 200
+    THRESHOLD_MIN_CONTRAST = 50  # Grey levels between line and floor to adapt
+    HISTOGRAM_UPDATE_INTERVAL = 5  # Frames between search area histograms
+    HISTOGRAM_DECAY = 0.5  # Weight the old histogram keeps on each update
     SEARCH_HEIGHT_RATIO = 2  # Divide height by this to get search area
+    DETECTOR_MODE = "contour"  # "contour" or "scanline"
+    SCANLINE_BANDS = 6  # Horizontal bands sampled by the scanline detector
+    SCANLINE_ROW_STEP = 4  # Sample every Nth row within a band
+    SCANLINE_MIN_PIXELS = 3  # Sampled line pixels a band needs to count as a hit
+    VIEWER_TIMEOUT = 3  # Seconds a view is still produced after its last request
+    OVERLAY_GEOMETRY = True  # Send overlay shapes in metrics for the dashboard
+
+    # Deadline settings
+    FRAME_DEADLINE = None  # Seconds from capture to detection; None: 1 / CAMERA_FPS
+    DEADLINE_MAX_SCALE = 4  # Most the search area is downscaled (a power of two)
+    DEADLINE_HIGH_LOAD = 0.9  # Shed work when smoothed time / deadline passes this
+    DEADLINE_LOW_LOAD = 0.2  # Each step back costs up to 4x, so wait for headroom
+    DEADLINE_RECOVERY_FRAMES = 30  # Frames below DEADLINE_LOW_LOAD before stepping back
+
+    # Tracking settings
+    TRACKING_ENABLED = False
+    TRACKING_WINDOW = 80  # Width in px searched around the predicted line
+    TRACKING_ALPHA = 0.5  # Position gain of the alpha-beta filter
+    TRACKING_BETA = 0.1  # Velocity gain of the alpha-beta filter
+    TRACKING_MAX_MISSES = 3  # Frames to coast on the prediction before giving up
+    TRACKING_MIN_CONFIDENCE = 0.2  # Below this the line counts as lost
+    TRACKING_SLOW_CONFIDENCE = 0.4  # Below this, slow down in proportion
+
+    # Multi-core settings
+    PROCESS_WORKERS = 0  # >0 runs detection and JPEG encoding in this many processes
+    WORKER_RESULT_TIMEOUT = 1.0  # Seconds after capture before a frame is given up
 
     # Control settings
     STRAIGHT_SPEED = 50
     TURN_SPEED_SLOW = 30
     TURN_SPEED_FAST = 70
     ERROR_TOLERANCE = 10
+    MAX_SPEED = 100
+    CONTROLLER = "bang_bang"  # "bang_bang" or "pid"
+    CONTROL_RATE_HZ = 50  # Control loop rate, independent of CAMERA_FPS
+    MEASUREMENT_TIMEOUT = 0.3  # Seconds before a line position is too old to use
+    PID_KP = 0.4
+    PID_KI = 0.05
+    PID_KD = 0.02
+    PID_INTEGRAL_LIMIT = 200  # Anti-windup clamp on the integral (px * s)
+
+    # Motor output settings
+    MOTOR_BACKEND = "simulated"  # "pwm" to drive the real motors
+    MOTOR_LEFT_PINS = (17, 18)  # GPIO (forward, backward)
+    MOTOR_RIGHT_PINS = (22, 23)
+    MOTOR_MIN_WRITE_INTERVAL = 0.02  # Seconds between hardware writes
+    MOTOR_SLEW_RATE = 400  # Max speed change per second
+
+    # Telemetry settings
+    TELEMETRY_SIZE = 1024  # Frames of history kept for /metrics/history
+    PERF_ENABLED = True  # Per-stage timing histograms for /metrics/perf
+
+    # Recorder settings
+    RECORDER_ENABLED = False  # Record from startup, else POST /recorder/start
+    RECORDER_PATH = "recordings/ring.npy"  # Snapshots are saved next to it
+    RECORDER_CAPACITY = 600  # Frames kept in the ring file
+    RECORDER_ROI_ONLY = False  # Keep only the grayscale search area
+    RECORDER_QUEUE_SIZE = 32  # Frames waiting for the writer before dropping
+    RECORDER_SNAPSHOT_SECONDS = 10  # History saved by a snapshot
+    RECORDER_SNAPSHOT_ON_LOSS = True  # Snapshot automatically when the line is lost
+    RECORDER_SNAPSHOT_COOLDOWN = 30  # Seconds between automatic snapshots
 
     # Server settings
     SERVER_PORT = 8000
+    STREAM_BOUNDARY = "frame"
+    MAX_CONNECTIONS = 16  # Concurrent client connections
+    MAX_MEDIA_WORKERS = 6  # Of those, how many may serve images at once
+    MEDIA_SLOT_TIMEOUT = 0.5  # Seconds an image request waits for a slot
+    KEEP_ALIVE_TIMEOUT = 5  # Seconds before idle or stalled sockets are dropped
+    WS_PING_INTERVAL = 2  # Heartbeat so idle /ws sockets stay under the timeout
+    STATIC_DIRS = ("templates", "static")  # Served from memory, precompressed
+    STATIC_MAX_AGE = 0  # Seconds browsers reuse assets unasked; 0: check ETag first
+
+    # Global state. Each is an immutable value swapped in whole, so the
+    # pipeline and the HTTP handlers never wait on each other.
+    state = Published(
+        FrameSnapshot(
+            0,
+            None,
+            {
+                "seq": 0,
+                "line_position": None,
+                "error": None,
+                "left_speed": 0,
+                "right_speed": 0,
+                "timestamp": None,
+                "threshold_value": THRESHOLD_VALUE,
+                "control_mode": "auto",
+            },
+        )
+    )
+    control = Published(ControlInput("auto", 0, 0))
+
+    # Latest debug, raw and threshold images, JPEG-encoded once per frame
+    frame_stream = FrameChannel()
+    raw_stream = FrameChannel()
+    thresh_stream = FrameChannel()
+
+    # Per-frame history, set by main() once NumPy has loaded
+    telemetry = None
 
-    # Global state (with thread-safe access)
-    latest_frame = None
-    latest_thresh = None
-    latest_metrics = {
-        "line_position": None,
-        "error": None,
-        "left_speed": 0,
-        "right_speed": 0,
-        "timestamp": None,
-        "threshold_value": THRESHOLD_VALUE,
-        "control_mode": "auto",
-    }
-
-    # Locks for thread-safe access
-    frame_lock = threading.Lock()
-    thresh_lock = threading.Lock()
-    metrics_lock = threading.Lock()
-
-    # Control state
-    control_mode = "auto"
-    manual_left_speed = 0
-    manual_right_speed = 0
-    controller_lock = threading.Lock()
+    # Frame recorder, set by main()
+    recorder = None
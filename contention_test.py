@@ -0,0 +1,160 @@
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+from config import Config
+from snapshot import ControlInput, FrameSnapshot, Published
+
+
+# The old scheme: one dict updated in place under a lock that readers also
+# hold while they serialise it, and control input behind a second lock
+class LockedState:
+    def __init__(self, metrics):
+        self.metrics = dict(metrics)
+        self.metrics_lock = threading.Lock()
+        self.control = ["auto", 0, 0]
+        self.controller_lock = threading.Lock()
+
+    def publish_metrics(self, seq, metrics):
+        with self.metrics_lock:
+            self.metrics.update(metrics)
+
+    def read_control(self):
+        with self.controller_lock:
+            return tuple(self.control)
+
+    def read_metrics(self):
+        with self.metrics_lock:
+            return json.dumps(self.metrics)
+
+    def write_control(self, left_speed, right_speed):
+        with self.controller_lock:
+            self.control[:] = ["manual", left_speed, right_speed]
+
+
+class SnapshotState:
+    def __init__(self, metrics):
+        self.state = Published(FrameSnapshot(0, None, dict(metrics)))
+        self.control = Published(ControlInput("auto", 0, 0))
+
+    def publish_metrics(self, seq, metrics):
+        self.state.publish(FrameSnapshot(seq, time.monotonic(), metrics))
+
+    def read_control(self):
+        return self.control.current
+
+    def read_metrics(self):
+        return json.dumps(self.state.current.metrics)
+
+    def write_control(self, left_speed, right_speed):
+        self.control.publish(ControlInput("manual", left_speed, right_speed))
+
+
+STATES = {"locked": LockedState, "snapshot": SnapshotState}
+
+
+def sample_metrics(seq):
+    # Roughly what the render stage publishes, pipeline and motor stats included
+    return {
+        "line_position": 160.0 + seq % 7,
+        "line_velocity": 1.5,
+        "line_confidence": 0.9,
+        "line_heading": 2.0,
+        "error": float(seq % 7),
+        "left_speed": 50,
+        "right_speed": 50,
+        "seq": seq,
+        "timestamp": time.monotonic(),
+        "threshold_value": Config.THRESHOLD_VALUE,
+        "control_mode": "auto",
+        "pipeline": {
+            name: {"processed": seq, "dropped": 0}
+            for name in ("capture", "detect", "control", "render")
+        },
+        "motor": {"writes": seq, "coalesced": 0, "rate_limited": 0},
+    }
+
+
+def run_writer(state, stop_event, rate, publish_ns, control_ns):
+    # Stands in for the render and control stages
+    seq = 0
+    period = 1.0 / rate
+    while not stop_event.is_set():
+        seq += 1
+        metrics = sample_metrics(seq)
+        start = time.perf_counter_ns()
+        state.publish_metrics(seq, metrics)
+        publish_ns.append(time.perf_counter_ns() - start)
+
+        start = time.perf_counter_ns()
+        state.read_control()
+        control_ns.append(time.perf_counter_ns() - start)
+        time.sleep(period)
+
+
+def run_reader(state, stop_event, counts, index):
+    # Stands in for a handler serving /metrics and taking /control input
+    while not stop_event.is_set():
+        state.read_metrics()
+        state.write_control(index, index)
+        counts[index] += 1
+
+
+def run_phase(kind, readers, duration, rate):
+    state = STATES[kind](sample_metrics(0))
+    stop_event = threading.Event()
+    publish_ns, control_ns = [], []
+    counts = [0] * readers
+
+    threads = [
+        threading.Thread(
+            target=run_reader, args=(state, stop_event, counts, i), daemon=True
+        )
+        for i in range(readers)
+    ]
+    writer = threading.Thread(
+        target=run_writer,
+        args=(state, stop_event, rate, publish_ns, control_ns),
+        daemon=True,
+    )
+    for thread in threads + [writer]:
+        thread.start()
+    time.sleep(duration)
+    stop_event.set()
+    for thread in threads + [writer]:
+        thread.join(timeout=2)
+
+    return np.array(publish_ns) / 1000, np.array(control_ns) / 1000, sum(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure how long the pipeline's shared-state writes and "
+        "control reads take while HTTP-style readers hammer the same state"
+    )
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--rate", type=float, default=Config.CONTROL_RATE_HZ)
+    args = parser.parse_args()
+
+    print(
+        f"{'state':>9} {'readers':>8} {'publish p50 us':>15} {'p99 us':>8} "
+        f"{'max us':>8} {'control p99 us':>15} {'max us':>8} {'reads/s':>9}"
+    )
+    for kind in STATES:
+        for readers in (0, args.readers):
+            publish_us, control_us, reads = run_phase(
+                kind, readers, args.duration, args.rate
+            )
+            p50, p99 = np.percentile(publish_us, [50, 99])
+            print(
+                f"{kind:>9} {readers:>8} {p50:>15.1f} {p99:>8.1f} "
+                f"{publish_us.max():>8.1f} {np.percentile(control_us, 99):>15.1f} "
+                f"{control_us.max():>8.1f} {reads / args.duration:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from perf import Perf
+
+
+def encode_jpeg(image):
+    # Imported here so the web server can start before OpenCV has loaded
+    import cv2
+
+    _, encoded = cv2.imencode(".jpg", image)
+    return encoded.tobytes()
+
+
+# Latest-image slot shared by every viewer. Each published image is rendered
+# and JPEG encoded at most once, by whichever viewer asks for it first. An
+# optional render function turns the published image into the one shown, so
+# frames nobody asks for cost nothing beyond publishing.
+class FrameChannel:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._encode_lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self._image = None
+        self._render = None
+        self._seq = 0
+        self._rendered = (0, None)
+        self._jpeg = (0, None)
+        self._last_request = float("-inf")
+        # Swapped for FrameWorkers.encode_jpeg to encode in another process
+        self.encode = encode_jpeg
+        # Keeps ETags from one run from matching frames of the next
+        self._epoch = f"{time.time_ns():x}"
+
+    def publish(self, image, render=None):
+        with self._condition:
+            self._image = image
+            self._render = render
+            self._seq += 1
+            self._condition.notify_all()
+
+    def touch(self):
+        self._last_request = time.monotonic()
+
+    def is_watched(self, timeout):
+        # Lets producers skip building images nobody has asked for lately
+        return time.monotonic() - self._last_request < timeout
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def etag(self, seq):
+        return f'"{self._epoch}-{seq}"'
+
+    def wait_for_frame(self, last_seq, timeout=None):
+        self.touch()
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq != last_seq, timeout)
+            return self._seq
+
+    def get_image(self):
+        # The current image as shown, for viewers that don't want a JPEG
+        self.touch()
+        with self._condition:
+            seq, image, render = self._seq, self._image, self._render
+
+        if image is None:
+            return 0, None
+        if render is None:
+            return seq, image
+
+        rendered = self._rendered
+        if rendered[0] == seq:
+            return rendered
+
+        with self._render_lock:
+            if self._rendered[0] >= seq:
+                return self._rendered
+            self._rendered = (seq, render(image))
+            return self._rendered
+
+    def get_jpeg(self):
+        self.touch()
+        seq = self._seq
+        jpeg = self._jpeg
+        if jpeg[0] == seq:
+            return jpeg
+
+        with self._encode_lock:
+            # Another viewer may have encoded it while we waited
+            if self._jpeg[0] >= seq:
+                return self._jpeg
+            seq, image = self.get_image()
+            if image is None:
+                return 0, None
+            timer = Perf.start()
+            jpeg = self.encode(image)
+            Perf.stop("jpeg_encode", timer)
+            self._jpeg = (seq, jpeg)
+            return self._jpeg
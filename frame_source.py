@@ -0,0 +1,214 @@
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+from config import Config
+
+
+class FrameSource:
+    def __init__(self, replay_mode=None, fps=None, loop=None):
+        self.replay_mode = replay_mode or Config.REPLAY_MODE
+        self.fps = fps or Config.REPLAY_FPS
+        self.loop = Config.REPLAY_LOOP if loop is None else loop
+        self._next_frame_time = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def native_fps(self):
+        return Config.CAMERA_FPS
+
+    def read_raw(self):
+        raise NotImplementedError
+
+    def rewind(self):
+        raise NotImplementedError
+
+    def read(self):
+        frame = self.read_raw()
+        if frame is None and self.loop:
+            self.rewind()
+            frame = self.read_raw()
+        if frame is not None:
+            self._pace()
+        return frame
+
+    def _pace(self):
+        if self.replay_mode == "fast":
+            return
+
+        fps = self.native_fps() if self.replay_mode == "native" else self.fps
+        interval = 1.0 / fps
+        now = time.monotonic()
+        if self._next_frame_time is None:
+            self._next_frame_time = now
+        elif self._next_frame_time > now:
+            time.sleep(self._next_frame_time - now)
+        else:
+            # Fell behind, don't try to catch up with a burst of frames
+            self._next_frame_time = now
+        self._next_frame_time += interval
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+
+class CameraSource(FrameSource):
+    def __init__(self):
+        super().__init__(replay_mode="fast")
+        self.picam = None
+
+    def start(self):
+        from picamera2 import Picamera2
+
+        self.picam = Picamera2()
+        config = self.picam.create_video_configuration(
+            main={"size": Config.CAMERA_RESOLUTION, "format": Config.CAMERA_FORMAT},
+            raw=self.picam.sensor_modes[0],
+            controls={
+                "FrameDurationLimits": (
+                    int(1e6 / Config.CAMERA_FPS),
+                    int(1e6 / Config.CAMERA_FPS),
+                )
+            },
+        )
+        self.picam.configure(config)
+        self.picam.start()
+
+    def stop(self):
+        if self.picam is not None:
+            self.picam.stop()
+
+    def read_raw(self):
+        # The camera paces itself through FrameDurationLimits
+        frame = self.picam.capture_array()
+        if Config.CAMERA_FORMAT == "YUV420":
+            # Only the Y plane is needed; this is a view, nothing is copied
+            width, height = Config.CAMERA_RESOLUTION
+            return frame[:height, :width]
+        return frame
+
+
+class ImageDirectorySource(FrameSource):
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.paths = sorted(glob.glob(os.path.join(path, "*.png")))
+        if not self.paths:
+            raise ValueError(f"No PNG frames found in {path}")
+        self.index = 0
+
+    def read_raw(self):
+        if self.index >= len(self.paths):
+            return None
+        frame = cv2.imread(self.paths[self.index], cv2.IMREAD_UNCHANGED)
+        self.index += 1
+        return frame
+
+    def rewind(self):
+        self.index = 0
+
+
+class VideoFileSource(FrameSource):
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.capture = None
+
+    def start(self):
+        self.capture = cv2.VideoCapture(self.path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Could not open video {self.path}")
+
+    def stop(self):
+        if self.capture is not None:
+            self.capture.release()
+
+    def native_fps(self):
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        return fps if fps > 0 else Config.CAMERA_FPS
+
+    def read_raw(self):
+        ok, frame = self.capture.read()
+        return frame if ok else None
+
+    def rewind(self):
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+
+class NumpyStackSource(FrameSource):
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        # Memory-map so long recordings don't have to fit in RAM
+        self.frames = np.load(path, mmap_mode="r")
+        self.index = 0
+
+    def read_raw(self):
+        if self.index >= len(self.frames):
+            return None
+        frame = np.ascontiguousarray(self.frames[self.index])
+        self.index += 1
+        return frame
+
+    def rewind(self):
+        self.index = 0
+
+
+class RecordingSource(FrameSource):
+    # Ring file or snapshot written by FrameRecorder, played back in seq order
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.rows = np.load(path, mmap_mode="r")
+        seqs = np.asarray(self.rows["seq"])
+        # Slots the ring hasn't reached yet are still zero
+        recorded = np.flatnonzero(seqs)
+        self.order = recorded[np.argsort(seqs[recorded], kind="stable")]
+        self.index = 0
+
+    def read_raw(self):
+        if self.index >= len(self.order):
+            return None
+        row = self.rows[self.order[self.index]]
+        self.index += 1
+
+        frame = row["frame"]
+        height = int(row["frame_height"])
+        if frame.shape[0] < height:
+            # Only the search area was kept; pad the rest with background so
+            # process_frame searches the same rows it did live
+            padded = np.full((height,) + frame.shape[1:], 255, dtype=np.uint8)
+            padded[: frame.shape[0]] = frame
+            return padded
+        return np.ascontiguousarray(frame)
+
+    def rewind(self):
+        self.index = 0
+
+
+FRAME_SOURCES = {
+    "images": ImageDirectorySource,
+    "video": VideoFileSource,
+    "npy": NumpyStackSource,
+    "recording": RecordingSource,
+}
+
+
+def create_frame_source(source_type=None, path=None, **kwargs):
+    source_type = source_type or Config.FRAME_SOURCE
+    path = path or Config.FRAME_SOURCE_PATH
+
+    if source_type == "camera":
+        return CameraSource()
+    if source_type not in FRAME_SOURCES:
+        raise ValueError(f"Unknown frame source: {source_type}")
+    if path is None:
+        raise ValueError(f"Frame source '{source_type}' needs FRAME_SOURCE_PATH")
+    return FRAME_SOURCES[source_type](path, **kwargs)
@@ -1,31 +1,131 @@
+import math
+from collections import namedtuple
+
 import cv2
 import numpy as np
 from config import Config
+from adaptive_threshold import AdaptiveThreshold
+
+
+# x/y is the line position used for steering. box is only set by the contour
+# detector; points, heading (degrees, 0 = straight ahead) and curvature only
+# by the scanline detector.
+LineData = namedtuple(
+    "LineData", "x y thresh thresh_value box points heading curvature"
+)
 
 
 class ImageProcessor:
+    thresholder = AdaptiveThreshold()
+
     @staticmethod
-    def process_frame(frame):
+    def to_gray(frame):
+        if frame.ndim == 2:
+            # Already luma (e.g. the Y plane of a YUV420 capture)
+            return frame
         if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)
+            return cv2.cvtColor(frame, cv2.COLOR_RGBA2GRAY)
+        return cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+
+    @staticmethod
+    def threshold(gray, value):
+        _, thresh = cv2.threshold(gray, value, 255, cv2.THRESH_BINARY_INV)
+        return thresh
+
+    @staticmethod
+    def process_frame(frame, mode=None, window=None, scale=1, views=True):
+        # Search area is the top 1/SEARCH_HEIGHT_RATIO of the image,
+        # optionally narrowed to the (left, right) columns in window and
+        # shrunk by scale (a power of two) one 2x2 box-filter pyramid level
+        # at a time. views=False skips the /threshold image even while
+        # someone is watching.
+        height = frame.shape[0]
+        search_bottom = height // Config.SEARCH_HEIGHT_RATIO
+        left, right = window or (0, frame.shape[1])
+
+        gray = ImageProcessor.to_gray(frame[0:search_bottom, left:right])
+        for _ in range(scale.bit_length() - 1):
+            # INTER_AREA at exactly half size is a 2x2 average, far cheaper
+            # than pyrDown's 5x5 Gaussian and just as good for thresholding
+            gray = cv2.resize(
+                gray,
+                (gray.shape[1] // 2, gray.shape[0] // 2),
+                interpolation=cv2.INTER_AREA,
+            )
+        value = ImageProcessor.thresholder.update(gray)
 
-        # Convert to grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        thresh = None
+        if views and Config.thresh_stream.is_watched(Config.VIEWER_TIMEOUT):
+            # Someone is watching /threshold, so threshold the whole frame
+            thresh = ImageProcessor.threshold(ImageProcessor.to_gray(frame), value)
+            Config.thresh_stream.publish(thresh)
 
-        # Threshold to get line
-        _, thresh = cv2.threshold(
-            gray, Config.THRESHOLD_VALUE, 255, cv2.THRESH_BINARY_INV
+        if thresh is not None and scale == 1:
+            top_half = np.ascontiguousarray(thresh[0:search_bottom, left:right])
+        else:
+            # Only the search area is ever looked at
+            top_half = ImageProcessor.threshold(gray, value)
+
+        if (mode or Config.DETECTOR_MODE) == "scanline":
+            line_data = ImageProcessor.find_line_scanline(top_half, value)
+        else:
+            line_data = ImageProcessor.find_line_contour(top_half, value)
+
+        if scale > 1:
+            line_data = ImageProcessor.rescale(line_data, scale)
+        if left:
+            line_data = ImageProcessor.shift(line_data, left)
+        return line_data
+
+    @staticmethod
+    def find_line(frame, window=None, scale=1, views=True):
+        # Look inside the window first, the whole band on a miss
+        line_data = ImageProcessor.process_frame(
+            frame, window=window, scale=scale, views=views
         )
+        if window is not None and line_data.x is None:
+            line_data = ImageProcessor.process_frame(frame, scale=scale, views=views)
+        return line_data
 
-        # Store threshold image for display
-        with Config.thresh_lock:
-            Config.latest_thresh = thresh.copy()
+    @staticmethod
+    def rescale(line_data, factor):
+        # Map a result found on a downscaled search area back to full size.
+        # A small pixel's centre maps to the centre of the block it covers.
+        # The box and points are only drawn, so they stay whole pixels.
+        if line_data.x is None:
+            return line_data
 
-        # Get top half of image
-        height = thresh.shape[0]
-        search_bottom = height // Config.SEARCH_HEIGHT_RATIO
-        top_half = thresh[0:search_bottom, :]
+        def scale(v):
+            return (v + 0.5) * factor - 0.5
 
+        return line_data._replace(
+            x=scale(line_data.x),
+            y=scale(line_data.y),
+            box=(
+                None
+                if line_data.box is None
+                else np.intp(np.rint(scale(line_data.box)))
+            ),
+            points=line_data.points
+            and [(round(scale(x)), round(scale(y))) for x, y in line_data.points],
+            curvature=(
+                None if line_data.curvature is None else line_data.curvature / factor
+            ),
+        )
+
+    @staticmethod
+    def shift(line_data, dx):
+        # Move a result found inside a search window back to frame coordinates
+        if line_data.x is None:
+            return line_data
+        return line_data._replace(
+            x=line_data.x + dx,
+            box=None if line_data.box is None else line_data.box + (dx, 0),
+            points=line_data.points and [(x + dx, y) for x, y in line_data.points],
+        )
+
+    @staticmethod
+    def find_line_contour(top_half, thresh_value):
         # Find the line in the top half
         contours, _ = cv2.findContours(
             top_half, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
@@ -35,20 +135,106 @@ class ImageProcessor:
             largest_contour = max(contours, key=cv2.contourArea)
             rect = cv2.minAreaRect(largest_contour)
             box = cv2.boxPoints(rect)
-            box = np.int0(box)
+            box = np.intp(box)
 
             cx = int(rect[0][0])
             cy = int(rect[0][1])
 
-            return cx, cy, thresh, Config.THRESHOLD_VALUE, box
+            return LineData(
+                cx, cy, top_half, thresh_value, box, None, None, None
+            )
+
+        return LineData(
+            None, None, top_half, thresh_value, None, None, None, None
+        )
+
+    @staticmethod
+    def find_line_scanline(top_half, thresh_value):
+        # Split the search area into horizontal bands and take the centroid
+        # of the line pixels in each band from its column sums
+        bands = Config.SCANLINE_BANDS
+        band_height = top_half.shape[0] // bands
+        width = top_half.shape[1]
+
+        columns = top_half[: bands * band_height].reshape(bands, band_height, width)
+        # Every SCANLINE_ROW_STEP-th row is plenty to locate a line that wide
+        rows = columns[:, :: Config.SCANLINE_ROW_STEP]
+        column_sums = rows.sum(axis=1, dtype=np.uint32).astype(np.float32)
+        mass = column_sums.sum(axis=1)
+        xs = column_sums @ np.arange(width, dtype=np.float32)
+
+        found = mass >= Config.SCANLINE_MIN_PIXELS * 255
+        if not found.any():
+            return LineData(
+                None, None, top_half, thresh_value, None, [], None, None
+            )
+
+        weights = mass[found]
+        band_x = (xs[found] / weights).tolist()
+        band_y = ((np.flatnonzero(found) + 0.5) * band_height).tolist()
+        points = [(int(x), int(y)) for x, y in zip(band_x, band_y)]
+
+        total = float(weights.sum())
+        cx = float(weights @ np.array(band_x, dtype=np.float32)) / total
+        cy = float(weights @ np.array(band_y, dtype=np.float32)) / total
+
+        # Slope and bend as x over y, since the line runs mostly up the image.
+        # Three points are enough at this resolution, no need for a fit.
+        heading = curvature = None
+        if len(points) >= 2:
+            x0, x2 = band_x[0], band_x[-1]
+            y0, y2 = band_y[0], band_y[-1]
+            heading = math.degrees(math.atan(-(x2 - x0) / (y2 - y0)))
+        if len(points) >= 3:
+            x1, y1 = band_x[len(band_x) // 2], band_y[len(band_y) // 2]
+            curvature = (
+                2 * ((x2 - x1) / (y2 - y1) - (x1 - x0) / (y1 - y0)) / (y2 - y0)
+            )
 
-        return None, None, thresh, Config.THRESHOLD_VALUE, None
+        return LineData(
+            int(cx),
+            int(cy),
+            top_half,
+            thresh_value,
+            None,
+            points,
+            heading,
+            curvature,
+        )
+
+    @staticmethod
+    def to_display(frame):
+        # JPEG has no alpha channel; grey and 3-channel frames encode as is
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            return cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)
+        return frame
+
+    @staticmethod
+    def overlay_geometry(frame, line_data, error):
+        # What create_debug_frame draws, as plain numbers for the dashboard
+        # to draw over the raw stream itself
+        height, width = frame.shape[:2]
+        found = line_data.x is not None
+        return {
+            "width": width,
+            "height": height,
+            "search_box": [0, 0, width, height // Config.SEARCH_HEIGHT_RATIO],
+            "box": line_data.box.tolist() if line_data.box is not None else None,
+            "points": [[int(x), int(y)] for x, y in line_data.points or []],
+            "centroid": [round(line_data.x), round(line_data.y)] if found else None,
+            "error": error,
+            "threshold": line_data.thresh_value,
+        }
 
     @staticmethod
     def create_debug_frame(frame, line_data, error, left_speed, right_speed):
-        line_pos_x, line_pos_y, thresh, thresh_value, box = line_data
+        # Rescaled results can be between pixels
+        line_pos_x = None if line_data.x is None else round(line_data.x)
+        line_pos_y = None if line_data.y is None else round(line_data.y)
 
-        if frame.shape[2] == 4:
+        if frame.ndim == 2:
+            debug_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        elif frame.shape[2] == 4:
             debug_frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)
         else:
             debug_frame = frame.copy()
@@ -61,9 +247,10 @@ class ImageProcessor:
         )
 
         # Draw info text
+        mode = Config.control.current.mode
         cv2.putText(
             debug_frame,
-            f"Threshold: {thresh_value} | Mode: {Config.control_mode}",
+            f"Threshold: {line_data.thresh_value} | Mode: {mode}",
             (10, 20),
             cv2.FONT_HERSHEY_SIMPLEX,
             0.5,
@@ -71,9 +258,17 @@ class ImageProcessor:
             1,
         )
 
-        if line_pos_x is not None and box is not None:
+        if line_data.points:
+            # Draw scanline centroids
+            points = np.array(line_data.points, dtype=np.int32)
+            cv2.polylines(debug_frame, [points], False, (0, 0, 255), 2)
+            for point in line_data.points:
+                cv2.circle(debug_frame, point, 3, (0, 0, 255), -1)
+
+        if line_pos_x is not None:
             # Draw bounding box and center
-            cv2.drawContours(debug_frame, [box], 0, (0, 0, 255), 2)
+            if line_data.box is not None:
+                cv2.drawContours(debug_frame, [line_data.box], 0, (0, 0, 255), 2)
             cv2.circle(debug_frame, (line_pos_x, line_pos_y), 5, (0, 255, 0), -1)
 
             # Draw error line
@@ -0,0 +1,68 @@
+from collections import namedtuple
+
+from config import Config
+
+
+TrackState = namedtuple("TrackState", "x velocity confidence")
+LOST = TrackState(None, 0.0, 0.0)
+
+
+# Alpha-beta filter on the line's x position (px) and velocity (px/s). It
+# predicts where the line will be so the detector only has to search a
+# narrow window, and coasts on the prediction for a few missed frames.
+class LineTracker:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.x = None
+        self.velocity = 0.0
+        self.confidence = 0.0
+        self.timestamp = None
+        self.misses = 0
+
+    def predict(self, timestamp):
+        if self.x is None:
+            return None
+        return self.x + self.velocity * (timestamp - self.timestamp)
+
+    def search_window(self, timestamp, width):
+        # After a miss, search the whole band again
+        predicted = self.predict(timestamp)
+        if predicted is None or self.misses:
+            return None
+
+        half = Config.TRACKING_WINDOW // 2
+        left = int(min(max(predicted - half, 0), width - Config.TRACKING_WINDOW))
+        return max(left, 0), min(left + Config.TRACKING_WINDOW, width)
+
+    def update(self, timestamp, measured_x):
+        if self.x is None:
+            if measured_x is None:
+                return LOST
+            self.x = float(measured_x)
+            self.confidence = Config.TRACKING_ALPHA
+            self.timestamp = timestamp
+            return TrackState(self.x, self.velocity, self.confidence)
+
+        dt = max(timestamp - self.timestamp, 1e-3)
+        predicted = self.x + self.velocity * dt
+        self.timestamp = timestamp
+
+        if measured_x is None:
+            self.misses += 1
+            if self.misses > Config.TRACKING_MAX_MISSES:
+                self.reset()
+                return LOST
+            self.x = predicted
+            self.confidence *= 1 - Config.TRACKING_ALPHA
+        else:
+            self.misses = 0
+            residual = measured_x - predicted
+            self.x = predicted + Config.TRACKING_ALPHA * residual
+            self.velocity += Config.TRACKING_BETA * residual / dt
+            # Confidence rises while measurements land where predicted
+            agreement = max(0.0, 1 - abs(residual) / Config.TRACKING_WINDOW)
+            self.confidence += Config.TRACKING_ALPHA * (agreement - self.confidence)
+
+        return TrackState(self.x, self.velocity, self.confidence)
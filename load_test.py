@@ -0,0 +1,112 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+
+import numpy as np
+from config import Config
+from web_server import RobotHTTPServer, StreamingHandler
+
+
+class QuietHandler(StreamingHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def publish_frames(stop_event, fps):
+    # Noise doesn't compress, so every JPEG is as expensive as it gets
+    rng = np.random.default_rng(0)
+    height = Config.CAMERA_RESOLUTION[1]
+    width = Config.CAMERA_RESOLUTION[0]
+    while not stop_event.is_set():
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        Config.frame_stream.publish(frame)
+        Config.thresh_stream.publish(frame[:, :, 0])
+        time.sleep(1.0 / fps)
+
+
+def run_viewer(host, port, stop_event, slow):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    while not stop_event.is_set():
+        try:
+            conn.request("GET", "/frame")
+            response = conn.getresponse()
+            if slow:
+                # Trickle the body in like a viewer on bad Wi-Fi
+                while response.read(1024):
+                    time.sleep(0.005)
+            else:
+                response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+
+
+def measure_control_latency(host, port, duration, rate):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    body = json.dumps({"mode": "auto", "left_speed": 0, "right_speed": 0})
+    headers = {"Content-Type": "application/json"}
+    latencies = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        conn.request("POST", "/control", body, headers)
+        conn.getresponse().read()
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(1.0 / rate)
+    conn.close()
+    return np.array(latencies)
+
+
+def run_phase(host, port, viewers, slow, duration, rate):
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(
+            target=run_viewer, args=(host, port, stop_event, slow), daemon=True
+        )
+        for _ in range(viewers)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        return measure_control_latency(host, port, duration, rate)
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join(timeout=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure /control latency while viewers pull frames"
+    )
+    parser.add_argument("--host", help="Test a running robot instead of in-process")
+    parser.add_argument("--port", type=int, default=Config.SERVER_PORT)
+    parser.add_argument("--viewers", type=int, default=8)
+    parser.add_argument("--slow", action="store_true", help="Viewers read slowly")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--rate", type=float, default=20.0, help="Control POSTs/s")
+    args = parser.parse_args()
+
+    host, port = args.host, args.port
+    if host is None:
+        httpd = RobotHTTPServer(("127.0.0.1", 0), QuietHandler)
+        host, port = httpd.server_address
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        stop_event = threading.Event()
+        threading.Thread(
+            target=publish_frames, args=(stop_event, 30), daemon=True
+        ).start()
+
+    print(f"{'viewers':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for viewers in (0, args.viewers):
+        latencies = run_phase(host, port, viewers, args.slow, args.duration, args.rate)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(
+            f"{viewers:>8} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f} {latencies.max():>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,111 @@
-from picamera2 import Picamera2
-import time
-from datetime import datetime
+# First, so startup timings count from as early as possible
+from startup import Startup
+
 import threading
-from http.server import HTTPServer
+from concurrent.futures import ThreadPoolExecutor
 
 from config import Config
-from web_server import StreamingHandler
-from image_processor import ImageProcessor
-from robot_controller import RobotController
+from web_server import RobotHTTPServer, StreamingHandler
+from perf import Perf
+
+# OpenCV, NumPy and the camera and motor libraries take seconds to import on
+# a Pi Zero, so they're imported by the startup phases that need them, with
+# the web server already answering /health.
 
 
-def run_server():
+def start_server():
     server_address = ("", Config.SERVER_PORT)
-    httpd = HTTPServer(server_address, StreamingHandler)
+    httpd = RobotHTTPServer(server_address, StreamingHandler)
     print(f"Starting monitoring server on port {Config.SERVER_PORT}")
-    httpd.serve_forever()
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def start_source():
+    from frame_source import create_frame_source
+
+    source = create_frame_source()
+    source.start()
+    return source
+
+
+def start_motors():
+    from motor_driver import create_motor_driver
+
+    return create_motor_driver()
+
+
+def warm_up_detector():
+    # Loads OpenCV and NumPy and makes the first (slow) calls into them on a
+    # blank frame, so the first camera frame doesn't pay for any of it
+    import numpy as np
+    from adaptive_threshold import AdaptiveThreshold
+    from frame_channel import encode_jpeg
+    from image_processor import ImageProcessor
+    from telemetry import TelemetryRing
+
+    width, height = Config.CAMERA_RESOLUTION
+    frame = np.full((height, width, 3), 200, dtype=np.uint8)
+    ImageProcessor.find_line(frame, views=False)
+    encode_jpeg(frame)
+    # Don't let the blank frame skew the adaptive threshold
+    ImageProcessor.thresholder = AdaptiveThreshold()
+
+    Config.telemetry = TelemetryRing(Config.TELEMETRY_SIZE)
 
 
 def main():
+    Perf.enabled = Config.PERF_ENABLED
+
     # Start monitoring server
-    server_thread = threading.Thread(target=run_server, daemon=True)
-    server_thread.start()
-
-    # Setup camera
-    picam = Picamera2()
-    config = picam.create_video_configuration(
-        main={"size": Config.CAMERA_RESOLUTION, "format": Config.CAMERA_FORMAT},
-        raw=picam.sensor_modes[0],
-        controls={
-            "FrameDurationLimits": (
-                int(1e6 / Config.CAMERA_FPS),
-                int(1e6 / Config.CAMERA_FPS),
-            )
-        },
-    )
-    picam.configure(config)
-    picam.start()
+    Startup.run("server", start_server)
+
+    # The camera is slowest to come up, mostly waiting on hardware, so the
+    # motors and detector get ready alongside it
+    with ThreadPoolExecutor(3, thread_name_prefix="startup") as pool:
+        source = pool.submit(Startup.run, "camera", start_source)
+        driver = pool.submit(Startup.run, "motors", start_motors)
+        detector = pool.submit(Startup.run, "detector", warm_up_detector)
+        source, driver = source.result(), driver.result()
+        detector.result()
+
+    from pipeline import Pipeline
+    from recorder import FrameRecorder
+
+    # Idle until RECORDER_ENABLED or POST /recorder/start
+    recorder = FrameRecorder()
+    recorder.start()
+    Config.recorder = recorder
+
+    workers = None
+    if Config.PROCESS_WORKERS:
+        from workers import FrameWorkers
+
+        workers = FrameWorkers()
+        workers.start()
+        for channel in (Config.frame_stream, Config.raw_stream, Config.thresh_stream):
+            channel.encode = workers.encode_jpeg
+
+    # Capture, detect, control and render each run on their own thread.
+    # /ready turns 200 once the first command based on a frame goes out.
+    pipeline = Pipeline(source, driver, recorder, workers)
+    pipeline.start()
 
     try:
-        while True:
-            frame = picam.capture_array()
-            line_data = ImageProcessor.process_frame(frame)
-            line_pos_x = line_data[0]
-
-            with Config.controller_lock:
-                if Config.control_mode == "manual":
-                    left_speed = Config.manual_left_speed
-                    right_speed = Config.manual_right_speed
-                else:  # Auto mode
-                    left_speed, right_speed = RobotController.calculate_motor_speeds(
-                        frame.shape[1], line_pos_x
-                    )
-
-                error = (
-                    frame.shape[1] / 2 - line_pos_x if line_pos_x is not None else None
-                )
-
-                # Update debug frame and metrics
-                debug_frame = ImageProcessor.create_debug_frame(
-                    frame, line_data, error, left_speed, right_speed
-                )
-
-                with Config.frame_lock:
-                    Config.latest_frame = debug_frame
-
-                with Config.metrics_lock:
-                    Config.latest_metrics.update(
-                        {
-                            "line_position": line_pos_x,
-                            "error": error,
-                            "left_speed": left_speed,
-                            "right_speed": right_speed,
-                            "timestamp": datetime.now().strftime("%H:%M:%S.%f")[:-3],
-                            "threshold_value": Config.THRESHOLD_VALUE,
-                            "control_mode": Config.control_mode,
-                        }
-                    )
-
-            time.sleep(0.01)
-
+        pipeline.wait()
     except KeyboardInterrupt:
-        picam.stop()
         print("\nShutting down...")
+    finally:
+        # The control loop must be gone before the motors are stopped, or
+        # its last command could land after the stop
+        pipeline.stop()
+        pipeline.join()
+        driver.stop()
+        driver.close()
+        recorder.close()
+        if workers is not None:
+            workers.close()
+        source.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,23 @@
+import numpy as np
+
+
+def pack_bits(mask):
+    # One bit per pixel, row by row, most significant bit first; 1 is line
+    return np.packbits(mask, axis=None).tobytes()
+
+
+def run_lengths(mask):
+    # Lengths of alternating background and line runs, row by row, as
+    # little-endian uint32. The first run is background and may be empty.
+    flat = mask.ravel() != 0
+    edges = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    runs = np.diff(np.concatenate(([0], edges, [flat.size])))
+    if flat.size and flat[0]:
+        runs = np.concatenate(([0], runs))
+    return runs.astype("<u4").tobytes()
+
+
+MASK_ENCODERS = {
+    "bits": pack_bits,
+    "rle": run_lengths,
+}
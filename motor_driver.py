@@ -0,0 +1,132 @@
+import time
+from collections import deque
+
+from config import Config
+
+
+# Sits between the control loop and the motors. Commands arrive at control
+# rate and move a slewed output towards them by MOTOR_SLEW_RATE per second
+# of command time; only changes to the output are written, and no more often
+# than every MOTOR_MIN_WRITE_INTERVAL. A full stop always goes straight
+# through.
+class MotorDriver:
+    def __init__(self):
+        self.left_speed = 0  # Last written
+        self.right_speed = 0
+        self.output = (0.0, 0.0)  # Slewed, not yet rounded or written
+        self.target = (0, 0)
+        self.last_command = None
+        self.last_write = time.monotonic()
+        self.writes = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def write(self, left_speed, right_speed):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _slew(self, current, target, max_step):
+        return current + min(max(target - current, -max_step), max_step)
+
+    def command(self, left_speed, right_speed, timestamp=None):
+        now = time.monotonic()
+        timestamp = now if timestamp is None else timestamp
+        self.target = (left_speed, right_speed)
+
+        # A long gap between commands doesn't buy a bigger step
+        period = 1.0 / Config.CONTROL_RATE_HZ
+        elapsed = period if self.last_command is None else now - self.last_command
+        self.last_command = now
+
+        stopping = left_speed == 0 and right_speed == 0
+        if stopping:
+            self.output = (0.0, 0.0)
+        else:
+            max_step = Config.MOTOR_SLEW_RATE * min(elapsed, period)
+            self.output = (
+                self._slew(self.output[0], left_speed, max_step),
+                self._slew(self.output[1], right_speed, max_step),
+            )
+        left, right = round(self.output[0]), round(self.output[1])
+
+        if (left, right) == (self.left_speed, self.right_speed):
+            self.coalesced += 1
+            return False
+
+        if not stopping and now - self.last_write < Config.MOTOR_MIN_WRITE_INTERVAL:
+            self.rate_limited += 1
+            return False
+
+        self.write(left, right)
+        self.left_speed, self.right_speed = left, right
+        self.last_write = time.monotonic()
+        self.writes += 1
+
+        latency = self.last_write - timestamp
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        return True
+
+    def stop(self):
+        self.write(0, 0)
+        self.left_speed = self.right_speed = 0
+        self.output = (0.0, 0.0)
+        self.target = (0, 0)
+        self.last_write = time.monotonic()
+
+    def stats(self):
+        return {
+            "left_speed": self.left_speed,
+            "right_speed": self.right_speed,
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "latency_avg_ms": (
+                self.latency_total / self.writes * 1000 if self.writes else None
+            ),
+            "latency_max_ms": self.latency_max * 1000,
+        }
+
+
+class PWMMotorDriver(MotorDriver):
+    def __init__(self):
+        super().__init__()
+        from gpiozero import Motor
+
+        self.left_motor = Motor(*Config.MOTOR_LEFT_PINS, pwm=True)
+        self.right_motor = Motor(*Config.MOTOR_RIGHT_PINS, pwm=True)
+
+    def write(self, left_speed, right_speed):
+        # gpiozero takes -1..1, negative meaning backwards
+        self.left_motor.value = left_speed / Config.MAX_SPEED
+        self.right_motor.value = right_speed / Config.MAX_SPEED
+
+    def close(self):
+        self.left_motor.close()
+        self.right_motor.close()
+
+
+class SimulatedMotorDriver(MotorDriver):
+    def __init__(self, history=1000):
+        super().__init__()
+        self.history = deque(maxlen=history)
+
+    def write(self, left_speed, right_speed):
+        self.history.append((time.monotonic(), left_speed, right_speed))
+
+
+MOTOR_DRIVERS = {
+    "pwm": PWMMotorDriver,
+    "simulated": SimulatedMotorDriver,
+}
+
+
+def create_motor_driver(backend=None):
+    backend = backend or Config.MOTOR_BACKEND
+    if backend not in MOTOR_DRIVERS:
+        raise ValueError(f"Unknown motor backend: {backend}")
+    return MOTOR_DRIVERS[backend]()
@@ -0,0 +1,162 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# Geometric bucket edges from 10 us to ~10 s, 25% apart
+BUCKETS_NS = [int(10_000 * 1.25**i) for i in range(63)]
+
+
+class Histogram:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(BUCKETS_NS) + 1)
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def observe(self, ns):
+        index = bisect_left(BUCKETS_NS, ns)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ns += ns
+            if ns > self.max_ns:
+                self.max_ns = ns
+
+    def percentile(self, q):
+        # Linear interpolation inside the bucket holding the q-th sample
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            max_ns = self.max_ns
+        if not count:
+            return None
+
+        target = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= target and bucket_count:
+                lower = BUCKETS_NS[index - 1] if index else 0
+                upper = BUCKETS_NS[index] if index < len(BUCKETS_NS) else max_ns
+                fraction = (target - cumulative) / bucket_count
+                return min(lower + (upper - lower) * fraction, max_ns)
+            cumulative += bucket_count
+        return max_ns
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ns / self.count / 1e6,
+            "p50_ms": self.percentile(0.50) / 1e6,
+            "p95_ms": self.percentile(0.95) / 1e6,
+            "p99_ms": self.percentile(0.99) / 1e6,
+            "max_ms": self.max_ns / 1e6,
+        }
+
+
+class RateCounter:
+    def __init__(self, window=100):
+        self.ticks = deque(maxlen=window)
+
+    def tick(self):
+        self.ticks.append(time.monotonic())
+
+    def rate(self):
+        ticks = list(self.ticks)
+        if len(ticks) < 2 or ticks[-1] == ticks[0]:
+            return None
+        return (len(ticks) - 1) / (ticks[-1] - ticks[0])
+
+
+# Hot-path timers. Call sites do
+#
+#     start = Perf.start()
+#     ...
+#     Perf.stop("stage", start)
+#
+# which costs two attribute checks when timing is disabled.
+class Perf:
+    enabled = True
+    histograms = {}
+    rates = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def start():
+        return time.perf_counter_ns() if Perf.enabled else 0
+
+    @staticmethod
+    def stop(stage, start):
+        if start:
+            Perf.observe(stage, time.perf_counter_ns() - start)
+
+    @staticmethod
+    def observe(stage, ns):
+        if not Perf.enabled:
+            return
+        histogram = Perf.histograms.get(stage)
+        if histogram is None:
+            with Perf._lock:
+                histogram = Perf.histograms.setdefault(stage, Histogram())
+        histogram.observe(ns)
+
+    @staticmethod
+    def tick(loop):
+        if not Perf.enabled:
+            return
+        counter = Perf.rates.get(loop)
+        if counter is None:
+            with Perf._lock:
+                counter = Perf.rates.setdefault(loop, RateCounter())
+        counter.tick()
+
+    @staticmethod
+    def report():
+        return {
+            "enabled": Perf.enabled,
+            "fps": {loop: counter.rate() for loop, counter in Perf.rates.items()},
+            "stages": {
+                stage: histogram.summary()
+                for stage, histogram in sorted(Perf.histograms.items())
+            },
+        }
+
+    @staticmethod
+    def prometheus():
+        lines = [
+            "# HELP robot_stage_duration_seconds Time spent per pipeline stage",
+            "# TYPE robot_stage_duration_seconds histogram",
+        ]
+        for stage, histogram in sorted(Perf.histograms.items()):
+            with histogram.lock:
+                counts = list(histogram.counts)
+                count = histogram.count
+                total_ns = histogram.total_ns
+            cumulative = 0
+            for edge, bucket_count in zip(BUCKETS_NS, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'robot_stage_duration_seconds_bucket{{stage="{stage}",'
+                    f'le="{edge / 1e9:.6g}"}} {cumulative}'
+                )
+            lines.append(
+                f'robot_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} '
+                f"{count}"
+            )
+            lines.append(
+                f'robot_stage_duration_seconds_sum{{stage="{stage}"}} {total_ns / 1e9}'
+            )
+            lines.append(
+                f'robot_stage_duration_seconds_count{{stage="{stage}"}} {count}'
+            )
+
+        lines.append("# HELP robot_loop_fps Recent iterations per second")
+        lines.append("# TYPE robot_loop_fps gauge")
+        for loop, counter in sorted(Perf.rates.items()):
+            rate = counter.rate()
+            if rate is not None:
+                lines.append(f'robot_loop_fps{{loop="{loop}"}} {rate}')
+        return "\n".join(lines) + "\n"
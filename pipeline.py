@@ -0,0 +1,425 @@
+import threading
+import time
+from collections import namedtuple
+from functools import partial
+
+from config import Config
+from image_processor import ImageProcessor
+from line_tracker import LineTracker, TrackState
+from perf import Perf
+from robot_controller import PIDController, RobotController
+from scheduler import DeadlineScheduler
+from snapshot import FrameSnapshot
+from startup import Startup
+
+
+CapturedFrame = namedtuple("CapturedFrame", "seq timestamp frame capture_ms")
+Detection = namedtuple("Detection", "seq timestamp frame line_data track error")
+Measurement = namedtuple("Measurement", "timestamp frame_width x velocity confidence")
+MotorCommand = namedtuple(
+    "MotorCommand", "timestamp left_speed right_speed control_mode"
+)
+
+
+# Single-slot handoff: a newer item replaces one that hasn't been consumed yet
+class Mailbox:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.posted = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self._condition:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self.posted += 1
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        with self._condition:
+            if self._item is None and not self._closed:
+                self._condition.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class Stage(threading.Thread):
+    def __init__(self, name, pipeline, inbox=None, outbox=None):
+        super().__init__(name=name, daemon=True)
+        self.pipeline = pipeline
+        self.inbox = inbox
+        self.outbox = outbox
+        self.processed = 0
+
+    def run(self):
+        try:
+            while not self.pipeline.stop_event.is_set():
+                if self.inbox is not None:
+                    item = self.inbox.get(timeout=0.1)
+                    if item is None:
+                        continue
+                    result = self.process(item)
+                else:
+                    result = self.process(None)
+                self.processed += 1
+                if self.outbox is not None and result is not None:
+                    self.outbox.put(result)
+        finally:
+            self.pipeline.stop()
+
+    def process(self, item):
+        raise NotImplementedError
+
+    def stats(self):
+        return {
+            "processed": self.processed,
+            "dropped": self.inbox.dropped if self.inbox is not None else 0,
+        }
+
+
+class CaptureStage(Stage):
+    def __init__(self, pipeline, source, outbox):
+        super().__init__("capture", pipeline, outbox=outbox)
+        self.source = source
+        self.seq = 0
+
+    def process(self, _):
+        start = time.monotonic()
+        timer = Perf.start()
+        frame = self.source.read()
+        if frame is None:
+            print("Frame source exhausted")
+            self.pipeline.stop()
+            return None
+        Perf.stop("capture", timer)
+        Perf.tick("capture")
+        self.seq += 1
+        now = time.monotonic()
+        return CapturedFrame(self.seq, now, frame, (now - start) * 1000)
+
+
+class DetectStage(Stage):
+    def __init__(self, pipeline, inbox, outbox, name="detect"):
+        super().__init__(name, pipeline, inbox, outbox)
+        self.tracker = LineTracker()
+
+    def process(self, captured):
+        scheduler = self.pipeline.scheduler
+        start = time.monotonic()
+        timer = Perf.start()
+        line_data = self.locate(captured, scheduler.scale, scheduler.views_enabled)
+        Perf.stop("process_frame", timer)
+        detect_ms = (time.monotonic() - start) * 1000
+        return self.finish(captured, line_data, detect_ms)
+
+    # locate, track and measure are the detection steps proper, which the
+    # simulator drives too; the rest of the stage is bookkeeping
+
+    def locate(self, captured, scale=1, views=True):
+        return ImageProcessor.find_line(
+            captured.frame, self.search_window(captured), scale, views
+        )
+
+    def track(self, captured, line_data):
+        if not Config.TRACKING_ENABLED:
+            return TrackState(line_data.x, 0.0, 1.0)
+        return self.tracker.update(captured.timestamp, line_data.x)
+
+    @staticmethod
+    def measure(captured, track):
+        return Measurement(
+            captured.timestamp,
+            captured.frame.shape[1],
+            track.x,
+            track.velocity,
+            track.confidence,
+        )
+
+    def search_window(self, captured):
+        if not Config.TRACKING_ENABLED:
+            return None
+        return self.tracker.search_window(
+            captured.timestamp, captured.frame.shape[1]
+        )
+
+    def finish(self, captured, line_data, detect_ms):
+        frame = captured.frame
+        Perf.tick("detect")
+        self.pipeline.scheduler.update(captured, time.monotonic())
+        track = self.track(captured, line_data)
+
+        # The control stage picks this up on its next tick
+        self.pipeline.measurement = self.measure(captured, track)
+
+        error = frame.shape[1] / 2 - track.x if track.x is not None else None
+
+        command = self.pipeline.command
+        Config.telemetry.record(
+            captured.seq,
+            captured.timestamp,
+            track.x,
+            error,
+            track.confidence,
+            command.left_speed,
+            command.right_speed,
+            line_data.thresh_value,
+            command.control_mode,
+            captured.capture_ms,
+            detect_ms,
+        )
+
+        if self.pipeline.recorder is not None:
+            self.pipeline.recorder.record(captured, line_data, track, error, command)
+
+        return Detection(
+            captured.seq, captured.timestamp, frame, line_data, track, error
+        )
+
+
+class DispatchStage(Stage):
+    # With PROCESS_WORKERS, hands frames to the worker processes in place of
+    # running detection itself. CollectStage picks the results up.
+    def __init__(self, pipeline, inbox, workers, collect):
+        super().__init__("dispatch", pipeline, inbox)
+        self.workers = workers
+        self.collect = collect
+
+    def process(self, captured):
+        window = self.collect.search_window(captured)
+        self.workers.submit(captured, window, self.pipeline.scheduler.scale)
+
+
+class CollectStage(DetectStage):
+    # Takes worker results in capture order and finishes them exactly as
+    # DetectStage would, tracker included
+    def __init__(self, pipeline, workers, outbox):
+        super().__init__(pipeline, None, outbox, name="collect")
+        self.workers = workers
+
+    def process(self, _):
+        result = self.workers.next_result(timeout=0.1)
+        if result is None:
+            return None
+        captured, line_data, detect_ms = result
+        Perf.observe("process_frame", int(detect_ms * 1e6))
+
+        # The workers' threshold images stay in the workers, so the view is
+        # redrawn here, and only if someone asks for it
+        if self.pipeline.scheduler.views_enabled and Config.thresh_stream.is_watched(
+            Config.VIEWER_TIMEOUT
+        ):
+            Config.thresh_stream.publish(
+                captured.frame, partial(self.render_threshold, line_data.thresh_value)
+            )
+        return self.finish(captured, line_data, detect_ms)
+
+    @staticmethod
+    def render_threshold(value, frame):
+        return ImageProcessor.threshold(ImageProcessor.to_gray(frame), value)
+
+    def stats(self):
+        return self.workers.stats()
+
+
+class ControlStage(Stage):
+    # Runs at CONTROL_RATE_HZ on whatever measurement is newest, extrapolated
+    # to the current time with the tracker's velocity
+    def __init__(self, pipeline):
+        super().__init__("control", pipeline)
+        self.pid = PIDController()
+        self.period = 1.0 / Config.CONTROL_RATE_HZ
+        self.next_tick = None
+        self.last_tick = None
+        self.late = 0
+
+    def process(self, _):
+        now = time.monotonic()
+        if self.next_tick is None:
+            self.next_tick = now
+        elif now < self.next_tick:
+            time.sleep(self.next_tick - now)
+            now = time.monotonic()
+        elif now - self.next_tick > self.period:
+            # Missed a whole tick; carry on from here rather than burst
+            self.late += 1
+            self.next_tick = now
+        self.next_tick += self.period
+
+        dt = now - self.last_tick if self.last_tick is not None else self.period
+        self.last_tick = now
+
+        timer = Perf.start()
+        command = self.compute(now, dt)
+        Perf.stop("calculate_motor_speeds", timer)
+        self.pipeline.command = command
+
+        timer = Perf.start()
+        self.pipeline.driver.command(
+            command.left_speed, command.right_speed, command.timestamp
+        )
+        Perf.stop("motor_command", timer)
+        Perf.tick("control")
+        if Startup.ready_at is None and self.pipeline.measurement is not None:
+            Startup.mark_ready()
+
+    def compute(self, now, dt):
+        control = Config.control.current
+        control_mode = control.mode
+
+        if control_mode == "manual":
+            return MotorCommand(
+                now, control.left_speed, control.right_speed, control_mode
+            )
+
+        measurement = self.pipeline.measurement
+        if (
+            measurement is None
+            or measurement.x is None
+            or now - measurement.timestamp > Config.MEASUREMENT_TIMEOUT
+        ):
+            self.pid.reset()
+            return MotorCommand(now, 0, 0, control_mode)
+
+        line_pos_x = measurement.x + measurement.velocity * (
+            now - measurement.timestamp
+        )
+        if Config.CONTROLLER == "pid":
+            speeds = RobotController.calculate_pid_speeds(
+                self.pid,
+                measurement.frame_width,
+                line_pos_x,
+                dt,
+                measurement.confidence,
+            )
+        else:
+            speeds = RobotController.calculate_motor_speeds(
+                measurement.frame_width, line_pos_x, measurement.confidence
+            )
+        return MotorCommand(now, *speeds, control_mode)
+
+    def stats(self):
+        return {"processed": self.processed, "dropped": 0, "late": self.late}
+
+
+class RenderStage(Stage):
+    def __init__(self, pipeline, inbox):
+        super().__init__("render", pipeline, inbox)
+
+    def process(self, detection):
+        command = self.pipeline.command
+
+        # Publishing only hands over references. The debug overlay is drawn
+        # when (and if) a viewer asks for this frame, unless frames are
+        # running late, in which case viewers keep the last one.
+        if self.pipeline.scheduler.views_enabled:
+            Config.frame_stream.publish(
+                detection.frame, partial(self.render, detection, command)
+            )
+            Config.raw_stream.publish(detection.frame, ImageProcessor.to_display)
+
+        metrics = {
+            "line_position": detection.track.x,
+            "line_velocity": detection.track.velocity,
+            "line_confidence": detection.track.confidence,
+            "line_heading": detection.line_data.heading,
+            "error": detection.error,
+            "left_speed": command.left_speed,
+            "right_speed": command.right_speed,
+            "seq": detection.seq,
+            "timestamp": detection.timestamp,
+            "threshold_value": detection.line_data.thresh_value,
+            "control_mode": command.control_mode,
+            "pipeline": self.pipeline.stats(),
+            "motor": self.pipeline.driver.stats(),
+            "scheduler": self.pipeline.scheduler.stats(),
+        }
+        if self.pipeline.recorder is not None:
+            metrics["recorder"] = self.pipeline.recorder.stats()
+        if Config.OVERLAY_GEOMETRY:
+            metrics["overlay"] = ImageProcessor.overlay_geometry(
+                detection.frame, detection.line_data, detection.error
+            )
+
+        # Readers may still hold the previous snapshot, so it's never mutated
+        Config.state.publish(
+            FrameSnapshot(detection.seq, detection.timestamp, metrics)
+        )
+        Perf.tick("render")
+
+    @staticmethod
+    def render(detection, command, frame):
+        # Runs on the viewer's thread, at most once per frame
+        start = time.monotonic()
+        timer = Perf.start()
+        debug_frame = ImageProcessor.create_debug_frame(
+            frame,
+            detection.line_data,
+            detection.error,
+            command.left_speed,
+            command.right_speed,
+        )
+        Perf.stop("create_debug_frame", timer)
+        Config.telemetry.set_render_time(
+            detection.seq, (time.monotonic() - start) * 1000
+        )
+        return debug_frame
+
+
+class Pipeline:
+    def __init__(self, source, driver, recorder=None, workers=None):
+        self.source = source
+        self.driver = driver
+        self.recorder = recorder
+        self.scheduler = DeadlineScheduler()
+        self.stop_event = threading.Event()
+        # Latest values, swapped in whole so readers never see a partial update
+        self.measurement = None
+        self.command = MotorCommand(
+            time.monotonic(), 0, 0, Config.control.current.mode
+        )
+        self.capture_box = Mailbox()
+        self.render_box = Mailbox()
+        if workers is None:
+            detect_stages = [DetectStage(self, self.capture_box, self.render_box)]
+        else:
+            collect = CollectStage(self, workers, self.render_box)
+            detect_stages = [
+                DispatchStage(self, self.capture_box, workers, collect),
+                collect,
+            ]
+        self.stages = [
+            CaptureStage(self, source, self.capture_box),
+            *detect_stages,
+            ControlStage(self),
+            RenderStage(self, self.render_box),
+        ]
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.capture_box.close()
+        self.render_box.close()
+
+    def wait(self):
+        # Poll so KeyboardInterrupt is still delivered to the main thread
+        while not self.stop_event.wait(0.5):
+            pass
+        self.join()
+
+    def join(self):
+        for stage in self.stages:
+            stage.join(timeout=2)
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
@@ -0,0 +1,196 @@
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from config import Config
+from image_processor import ImageProcessor
+from telemetry import mode_code
+
+
+def recording_dtype(frame_shape):
+    return np.dtype(
+        [
+            ("seq", np.uint32),
+            ("timestamp", np.float64),
+            ("frame_height", np.uint16),  # Height before any ROI crop
+            ("line_x", np.float32),  # Detector output, NaN when not found
+            ("track_x", np.float32),  # What control steered on
+            ("error", np.float32),
+            ("confidence", np.float32),
+            ("threshold", np.uint8),
+            ("left_speed", np.int16),
+            ("right_speed", np.int16),
+            ("mode", np.uint8),
+            ("frame", np.uint8, frame_shape),
+        ]
+    )
+
+
+def nan_if_none(value):
+    return np.nan if value is None else value
+
+
+# Keeps the last RECORDER_CAPACITY frames, with what was detected and
+# commanded for each, in a preallocated .npy file that is memory-mapped and
+# written in place as a ring. The pipeline only queues references; copying
+# into the map (and any disk I/O that triggers) happens on the writer
+# thread, and frames are dropped rather than waited for if it falls behind.
+#
+# Snapshots copy the last few seconds, in order, to their own .npy file.
+# Both kinds of file replay with FRAME_SOURCE = "recording".
+class FrameRecorder:
+    def __init__(self, path=None, capacity=None, roi_only=None):
+        self.path = path or Config.RECORDER_PATH
+        self.capacity = capacity or Config.RECORDER_CAPACITY
+        self.roi_only = Config.RECORDER_ROI_ONLY if roi_only is None else roi_only
+        self.recording = Config.RECORDER_ENABLED
+        self.queue = queue.Queue(maxsize=Config.RECORDER_QUEUE_SIZE)
+        self.closing = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        # The ring file is allocated on the first frame, once its shape is known
+        self.ring = None
+        self.rotated = False
+        self.count = 0
+        self.dropped = 0
+        self.snapshots = []
+        self.had_line = False
+        self.last_auto_snapshot = None
+
+    def start(self):
+        self.thread.start()
+
+    def close(self):
+        # The writer stops after the item it's on. If the queue is full the
+        # wake-up is dropped, but then the writer isn't waiting for one.
+        self.recording = False
+        self.closing.set()
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.thread.join(timeout=5)
+        if self.ring is not None:
+            self.ring.flush()
+
+    def record(self, captured, line_data, track, error, command):
+        # Called from the detect stage; never blocks
+        if not self.recording:
+            return
+        try:
+            self.queue.put_nowait(
+                ("frame", captured, line_data, track, error, command)
+            )
+        except queue.Full:
+            self.dropped += 1
+
+        lost = track.x is None and self.had_line
+        self.had_line = track.x is not None
+        if (
+            lost
+            and Config.RECORDER_SNAPSHOT_ON_LOSS
+            and command.control_mode == "auto"
+            and (
+                self.last_auto_snapshot is None
+                or captured.timestamp - self.last_auto_snapshot
+                >= Config.RECORDER_SNAPSHOT_COOLDOWN
+            )
+        ):
+            self.last_auto_snapshot = captured.timestamp
+            self.snapshot(reason="line-lost", block=False)
+
+    def snapshot(self, seconds=None, reason="manual", block=True):
+        # Queued behind the frames already waiting, so they are included
+        seconds = seconds or Config.RECORDER_SNAPSHOT_SECONDS
+        name = f"snapshot-{time.strftime('%Y%m%d-%H%M%S')}-{reason}.npy"
+        path = os.path.join(os.path.dirname(self.path) or ".", name)
+        try:
+            self.queue.put(("snapshot", path, seconds), block=block, timeout=1.0)
+        except queue.Full:
+            return None
+        return path
+
+    def _run(self):
+        while not self.closing.is_set():
+            item = self.queue.get()
+            if item is None:
+                return
+            # Nothing one frame does may stop the recording
+            try:
+                if item[0] == "frame":
+                    self._write(*item[1:])
+                else:
+                    self._save_snapshot(*item[1:])
+            except Exception as e:
+                print(f"Recorder error: {e!r}")
+
+    def _allocate(self, frame_shape):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # The last run's ring (ring.npy -> ring.prev.npy) survives one restart,
+        # so whatever went wrong before a reboot can still be replayed
+        if not self.rotated and os.path.exists(self.path):
+            root, ext = os.path.splitext(self.path)
+            os.replace(self.path, f"{root}.prev{ext}")
+        self.rotated = True
+        self.ring = np.lib.format.open_memmap(
+            self.path,
+            mode="w+",
+            dtype=recording_dtype(frame_shape),
+            shape=(self.capacity,),
+        )
+
+    def _write(self, captured, line_data, track, error, command):
+        frame = captured.frame
+        if self.roi_only:
+            search_bottom = frame.shape[0] // Config.SEARCH_HEIGHT_RATIO
+            frame = ImageProcessor.to_gray(frame[:search_bottom])
+
+        if self.ring is None:
+            self._allocate(frame.shape)
+        elif self.ring.dtype["frame"].shape != frame.shape:
+            self.dropped += 1
+            return
+
+        row = self.ring[self.count % self.capacity]
+        row["seq"] = captured.seq
+        row["timestamp"] = captured.timestamp
+        row["frame_height"] = captured.frame.shape[0]
+        row["line_x"] = nan_if_none(line_data.x)
+        row["track_x"] = nan_if_none(track.x)
+        row["error"] = nan_if_none(error)
+        row["confidence"] = track.confidence
+        row["threshold"] = line_data.thresh_value
+        row["left_speed"] = command.left_speed
+        row["right_speed"] = command.right_speed
+        row["mode"] = mode_code(command.control_mode)
+        row["frame"] = frame
+        self.count += 1
+
+    def rows(self):
+        # Everything in the ring, oldest first
+        if self.count <= self.capacity:
+            return self.ring[: self.count]
+        start = self.count % self.capacity
+        return np.concatenate((self.ring[start:], self.ring[:start]))
+
+    def _save_snapshot(self, path, seconds):
+        if self.ring is None:
+            return
+        rows = self.rows()
+        rows = rows[rows["timestamp"] >= rows["timestamp"][-1] - seconds]
+        np.save(path, rows)
+        self.ring.flush()
+        self.snapshots.append(path)
+        print(f"Saved {len(rows)} frames to {path}")
+
+    def stats(self):
+        return {
+            "recording": self.recording,
+            "path": self.path,
+            "frames": min(self.count, self.capacity),
+            "written": self.count,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+            "snapshots": self.snapshots[-5:],
+        }
@@ -0,0 +1,53 @@
+import argparse
+import time
+
+from config import Config
+from frame_source import create_frame_source
+from image_processor import ImageProcessor
+from robot_controller import RobotController
+
+
+def measure_throughput(source):
+    frames = 0
+    lost = 0
+    source.start()
+    start = time.perf_counter()
+    try:
+        for frame in source:
+            line_data = ImageProcessor.process_frame(frame)
+            left_speed, right_speed = RobotController.calculate_motor_speeds(
+                frame.shape[1], line_data.x
+            )
+            frames += 1
+            if line_data.x is None:
+                lost += 1
+    finally:
+        source.stop()
+    elapsed = time.perf_counter() - start
+    return frames, lost, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded frames through the detection and control code"
+    )
+    parser.add_argument("source", choices=["images", "video", "npy", "recording"])
+    parser.add_argument("path")
+    parser.add_argument("--mode", choices=["native", "fixed", "fast"], default="fast")
+    parser.add_argument("--fps", type=float, default=Config.REPLAY_FPS)
+    args = parser.parse_args()
+
+    source = create_frame_source(
+        args.source, args.path, replay_mode=args.mode, fps=args.fps, loop=False
+    )
+    frames, lost, elapsed = measure_throughput(source)
+
+    print(f"Frames:     {frames}")
+    print(f"Line lost:  {lost}")
+    print(f"Elapsed:    {elapsed:.3f} s")
+    if elapsed > 0:
+        print(f"Throughput: {frames / elapsed:.1f} fps")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,18 +3,84 @@ from config import Config
 
 class RobotController:
     @staticmethod
-    def calculate_motor_speeds(frame_width, line_pos_x):
-        if line_pos_x is None:
+    def speed_scale(confidence):
+        # A locked track runs at full speed. Confidence starts at
+        # TRACKING_ALPHA and only approaches 1, so just slow down while it's
+        # low, as after a few missed frames.
+        if confidence >= Config.TRACKING_SLOW_CONFIDENCE:
+            return 1.0
+        return confidence / Config.TRACKING_SLOW_CONFIDENCE
+
+    @staticmethod
+    def calculate_motor_speeds(frame_width, line_pos_x, confidence=1.0):
+        if line_pos_x is None or confidence < Config.TRACKING_MIN_CONFIDENCE:
             return 0, 0
 
         error = frame_width / 2 - line_pos_x
 
         if abs(error) < Config.ERROR_TOLERANCE:
             # Go straight
-            return Config.STRAIGHT_SPEED, Config.STRAIGHT_SPEED
+            speeds = Config.STRAIGHT_SPEED, Config.STRAIGHT_SPEED
         elif error > 0:
             # Turn left
-            return Config.TURN_SPEED_SLOW, Config.TURN_SPEED_FAST
+            speeds = Config.TURN_SPEED_SLOW, Config.TURN_SPEED_FAST
         else:
             # Turn right
-            return Config.TURN_SPEED_FAST, Config.TURN_SPEED_SLOW
+            speeds = Config.TURN_SPEED_FAST, Config.TURN_SPEED_SLOW
+
+        scale = RobotController.speed_scale(confidence)
+        if scale >= 1.0:
+            return speeds
+        # Slow down while unsure where the line is
+        return round(speeds[0] * scale), round(speeds[1] * scale)
+
+    @staticmethod
+    def calculate_pid_speeds(pid, frame_width, line_pos_x, dt, confidence=1.0):
+        if line_pos_x is None or confidence < Config.TRACKING_MIN_CONFIDENCE:
+            pid.reset()
+            return 0, 0
+
+        error = frame_width / 2 - line_pos_x
+        # Positive error means the line is to the left, so slow the left track.
+        # One wheel hits 0 or MAX_SPEED once |turn| passes the headroom.
+        base = Config.STRAIGHT_SPEED * RobotController.speed_scale(confidence)
+        turn = pid.update(error, dt, headroom=min(base, Config.MAX_SPEED - base))
+
+        left_speed = min(max(base - turn, 0), Config.MAX_SPEED)
+        right_speed = min(max(base + turn, 0), Config.MAX_SPEED)
+        return round(left_speed), round(right_speed)
+
+
+class PIDController:
+    def __init__(self, kp=None, ki=None, kd=None):
+        self.kp = Config.PID_KP if kp is None else kp
+        self.ki = Config.PID_KI if ki is None else ki
+        self.kd = Config.PID_KD if kd is None else kd
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.previous_error = None
+
+    def update(self, error, dt, headroom=None):
+        # headroom is the largest output that still changes what the motors
+        # do; beyond it a wheel is already at 0 or MAX_SPEED
+        if self.previous_error is None or dt <= 0:
+            derivative = 0.0
+        else:
+            derivative = (error - self.previous_error) / dt
+        self.previous_error = error
+
+        limit = Config.PID_INTEGRAL_LIMIT
+        integral = min(max(self.integral + error * dt, -limit), limit)
+        output = self.kp * error + self.ki * integral + self.kd * derivative
+
+        # Anti-windup: while the output is saturated, only let the integral
+        # shrink
+        if headroom is None:
+            headroom = Config.MAX_SPEED
+        saturated = abs(output) > headroom
+        if not saturated or abs(integral) < abs(self.integral):
+            self.integral = integral
+
+        return min(max(output, -Config.MAX_SPEED), Config.MAX_SPEED)
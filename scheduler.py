@@ -0,0 +1,78 @@
+from config import Config
+
+
+# Watches how long each frame takes from capture to detection against its
+# deadline and trades quality for time when frames run late. Each level
+# sheds more work: first the debug views, then the search area resolution,
+# halving it with an image pyramid down to 1/DEADLINE_MAX_SCALE. It climbs
+# back one level at a time after a run of frames with plenty of headroom.
+class DeadlineScheduler:
+    def __init__(self, budget=None):
+        self.budget = budget or Config.FRAME_DEADLINE or 1.0 / Config.CAMERA_FPS
+        # (scale, debug views on)
+        self.levels = [(1, True), (1, False)]
+        scale = 2
+        while scale <= Config.DEADLINE_MAX_SCALE:
+            self.levels.append((scale, False))
+            scale *= 2
+
+        self.level = 0
+        self.load = 0.0  # Smoothed processing time / budget
+        self.frames_at_level = 0
+        self.calm_frames = 0
+        self.frames = 0
+        self.misses = 0
+        self.roi_size = None
+
+    @property
+    def scale(self):
+        return self.levels[self.level][0]
+
+    @property
+    def views_enabled(self):
+        return self.levels[self.level][1]
+
+    def update(self, captured, finished):
+        elapsed = finished - captured.timestamp
+        missed = elapsed > self.budget
+        self.frames += 1
+        self.misses += missed
+        self.frames_at_level += 1
+        self.load += 0.2 * (elapsed / self.budget - self.load)
+
+        height, width = captured.frame.shape[:2]
+        self.roi_size = (width, height // Config.SEARCH_HEIGHT_RATIO)
+
+        # Give a new level a few frames to show its effect before moving on
+        settled = self.frames_at_level >= 5
+        if (missed or self.load > Config.DEADLINE_HIGH_LOAD) and settled:
+            if self.level < len(self.levels) - 1:
+                self._set_level(self.level + 1)
+            return
+
+        if self.load < Config.DEADLINE_LOW_LOAD:
+            self.calm_frames += 1
+        else:
+            self.calm_frames = 0
+        if self.calm_frames >= Config.DEADLINE_RECOVERY_FRAMES and self.level:
+            self._set_level(self.level - 1)
+
+    def _set_level(self, level):
+        self.level = level
+        self.frames_at_level = 0
+        self.calm_frames = 0
+
+    def stats(self):
+        resolution = None
+        if self.roi_size is not None:
+            resolution = [size // self.scale for size in self.roi_size]
+        return {
+            "level": self.level,
+            "scale": self.scale,
+            "resolution": resolution,
+            "views": self.views_enabled,
+            "budget_ms": self.budget * 1000,
+            "load": self.load,
+            "deadline_misses": self.misses,
+            "frames": self.frames,
+        }
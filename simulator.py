@@ -0,0 +1,299 @@
+import argparse
+import math
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+from config import Config
+from pipeline import CapturedFrame, ControlStage, DetectStage
+
+# Robot geometry, in metres
+WHEEL_BASE = 0.12
+MAX_WHEEL_SPEED = 0.4  # At MAX_SPEED
+CAMERA_NEAR = 0.05  # Ahead of the axle to the bottom edge of the view
+CAMERA_VIEW = (0.32, 0.24)  # Floor covered by the frame, width x length
+
+# Beyond this distance from the centreline the robot has left the track
+OFF_TRACK_DISTANCE = 0.15
+
+SimResult = namedtuple(
+    "SimResult",
+    "outcome lap_times sim_time wall_time frames lost_frames loss_events "
+    "mean_error rms_error max_error",
+)
+
+
+# Closed centreline on a light floor, rendered once into a map image that
+# camera frames are sampled from
+class Track:
+    def __init__(self, centreline, gaps=(), line_width=0.019, scale=500):
+        self.scale = scale  # Map pixels per metre
+        self.points, self.along, self.length = self._resample(
+            np.asarray(centreline, float)
+        )
+        self.gaps = gaps  # (start, length) in metres along the line
+
+        margin = CAMERA_NEAR + max(CAMERA_VIEW) + OFF_TRACK_DISTANCE
+        self.origin = margin - self.points.min(axis=0)
+        size = np.ceil((self.points.max(axis=0) + self.origin + margin) * scale)
+        self.map = np.full((int(size[1]), int(size[0])), 200, dtype=np.uint8)
+
+        drawn = np.ones(len(self.points), dtype=bool)
+        for start, length in gaps:
+            drawn &= (self.along - start) % self.length >= length
+        # Draw each unbroken run of the line separately
+        breaks = np.flatnonzero(np.diff(drawn)) + 1
+        for run in np.split(np.arange(len(self.points)), breaks):
+            if drawn[run[0]]:
+                pixels = np.round(self.to_map(self.points[run]) * 16)
+                pixels = pixels.astype(np.int32)
+                cv2.polylines(
+                    self.map,
+                    [pixels],
+                    False,
+                    30,
+                    max(1, round(line_width * scale)),
+                    cv2.LINE_AA,
+                    shift=4,
+                )
+
+    @staticmethod
+    def _resample(points, step=0.005):
+        # Evenly spaced samples so the index is a measure of distance
+        closed = np.vstack([points, points[:1]])
+        segment = np.linalg.norm(np.diff(closed, axis=0), axis=1)
+        along = np.concatenate([[0], np.cumsum(segment)])
+        samples = np.arange(0, along[-1], step)
+        resampled = np.column_stack(
+            [np.interp(samples, along, closed[:, i]) for i in range(2)]
+        )
+        return resampled, samples, along[-1]
+
+    @staticmethod
+    def default():
+        # Bean-shaped loop about 3 x 2 m: bends of varying radius, one of
+        # them the opposite way, and two short gaps in the tape
+        angles = np.linspace(0, 2 * np.pi, 2000, endpoint=False)
+        radius = 1.0 + 0.25 * np.cos(2 * angles) + 0.1 * np.sin(3 * angles)
+        centreline = np.column_stack(
+            [1.2 * radius * np.cos(angles), 0.9 * radius * np.sin(angles)]
+        )
+        length = Track._resample(centreline)[2]
+        return Track(centreline, gaps=[(length * 0.3, 0.04), (length * 0.7, 0.04)])
+
+    def to_map(self, points):
+        return (points + self.origin) * self.scale
+
+    def start_pose(self):
+        dx, dy = self.points[1] - self.points[0]
+        return self.points[0][0], self.points[0][1], math.atan2(dy, dx)
+
+    def nearest(self, x, y, hint):
+        # Search around the last nearest sample; the robot can't jump far
+        window = np.arange(hint - 100, hint + 100) % len(self.points)
+        distances = np.hypot(*(self.points[window] - (x, y)).T)
+        best = int(np.argmin(distances))
+        return int(window[best]), distances[best]
+
+
+# Renders what a downward-looking camera at (x, y, heading) would see.
+# Map and frame both have y pointing down, so the robot's right is heading
+# rotated by +90 degrees and appears on the right of the frame.
+class Camera:
+    def __init__(self, track, resolution=None, noise=8, lighting=0.2, seed=0):
+        self.track = track
+        self.width, self.height = resolution or Config.CAMERA_RESOLUTION
+        self.lighting = lighting
+        self.rng = np.random.default_rng(seed)
+        # A bank of noise frames is much cheaper than fresh noise every frame
+        self.noise = [
+            self.rng.normal(0, noise, (self.height, self.width)).astype(np.float32)
+            for _ in range(16)
+        ]
+        self.columns = np.linspace(-1, 1, self.width, dtype=np.float32)
+
+    def capture(self, x, y, heading):
+        ahead = np.array([math.cos(heading), math.sin(heading)])
+        right = np.array([-math.sin(heading), math.cos(heading)])
+        view_width, view_length = CAMERA_VIEW
+        scale = self.track.scale
+
+        # Frame (u, v) -> map pixel; v = 0 is the far edge of the view
+        far_left = (
+            np.array([x, y])
+            + (CAMERA_NEAR + view_length) * ahead
+            - view_width / 2 * right
+        )
+        transform = np.column_stack(
+            [
+                right * view_width / self.width * scale,
+                -ahead * view_length / self.height * scale,
+                self.track.to_map(far_left),
+            ]
+        )
+        frame = cv2.warpAffine(
+            self.track.map,
+            transform,
+            (self.width, self.height),
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderValue=200,
+        ).astype(np.float32)
+
+        # Uneven lighting: overall brightness flicker plus light from one side
+        gain = 1 + self.lighting * (self.rng.random() - 0.5)
+        slope = self.lighting * (self.rng.random() - 0.5)
+        frame *= gain * (1 + slope * self.columns)
+        frame += self.noise[self.rng.integers(len(self.noise))]
+        return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+class Simulation:
+    # Stands in for the pipeline, driving the real detection and control
+    # steps without their threads; those only read .measurement
+    def __init__(self, track, camera):
+        self.track = track
+        self.camera = camera
+        self.detector = DetectStage(self, None, None)
+        self.control = ControlStage(self)
+        self.measurement = None
+
+    def detect(self, now, frame, seq):
+        captured = CapturedFrame(seq, now, frame, 0.0)
+        line_data = self.detector.locate(captured, views=False)
+        track = self.detector.track(captured, line_data)
+        self.measurement = DetectStage.measure(captured, track)
+        return line_data
+
+    def run(self, laps=2, time_limit=300.0):
+        x, y, heading = self.track.start_pose()
+        left_speed = right_speed = 0.0
+        dt = 1.0 / Config.CONTROL_RATE_HZ
+        frame_interval = 1.0 / Config.CAMERA_FPS
+        slew = Config.MOTOR_SLEW_RATE * dt
+
+        now = 0.0
+        next_frame = 0.0
+        nearest, error = self.track.nearest(x, y, 0)
+        travelled = 0.0
+        lap_start = 0.0
+        lap_times = []
+        errors = []
+        frames = lost_frames = loss_events = 0
+        had_line = True
+        last_moved, moved_from = 0.0, (x, y)
+        outcome = "time limit"
+
+        wall_start = time.perf_counter()
+        while now < time_limit:
+            if now >= next_frame:
+                next_frame += frame_interval
+                frame = self.camera.capture(x, y, heading)
+                frames += 1
+                line_data = self.detect(now, frame, frames)
+                if line_data.x is None:
+                    lost_frames += 1
+                    loss_events += had_line
+                had_line = line_data.x is not None
+
+            command = self.control.compute(now, dt)
+            # Motors can't change speed instantly
+            left_speed += min(max(command.left_speed - left_speed, -slew), slew)
+            right_speed += min(max(command.right_speed - right_speed, -slew), slew)
+
+            # Differential drive kinematics
+            v_left = left_speed / Config.MAX_SPEED * MAX_WHEEL_SPEED
+            v_right = right_speed / Config.MAX_SPEED * MAX_WHEEL_SPEED
+            speed = (v_left + v_right) / 2
+            # Faster right track turns left, which is negative in y-down
+            heading += (v_left - v_right) / WHEEL_BASE * dt
+            x += speed * math.cos(heading) * dt
+            y += speed * math.sin(heading) * dt
+            now += dt
+
+            previous = nearest
+            nearest, error = self.track.nearest(x, y, nearest)
+            errors.append(error)
+            step = (nearest - previous) % len(self.track.points)
+            if step > len(self.track.points) / 2:
+                step -= len(self.track.points)
+            travelled += step * (self.track.length / len(self.track.points))
+
+            if error > OFF_TRACK_DISTANCE:
+                outcome = "off track"
+                break
+            if travelled >= self.track.length * (len(lap_times) + 1):
+                lap_times.append(now - lap_start)
+                lap_start = now
+                if len(lap_times) >= laps:
+                    outcome = "completed"
+                    break
+            if math.hypot(x - moved_from[0], y - moved_from[1]) > 0.01:
+                last_moved, moved_from = now, (x, y)
+            elif now - last_moved > 2.0:
+                outcome = "stalled"
+                break
+
+        errors = np.array(errors)
+        return SimResult(
+            outcome,
+            lap_times,
+            now,
+            time.perf_counter() - wall_start,
+            frames,
+            lost_frames,
+            loss_events,
+            errors.mean(),
+            math.sqrt((errors**2).mean()),
+            errors.max(),
+        )
+
+
+def simulate(laps=2, time_limit=300.0, noise=8, lighting=0.2, seed=0):
+    track = Track.default()
+    camera = Camera(track, noise=noise, lighting=lighting, seed=seed)
+    return Simulation(track, camera).run(laps, time_limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drive the detection and control code around a simulated track"
+    )
+    parser.add_argument("--laps", type=int, default=2)
+    parser.add_argument("--time-limit", type=float, default=300.0, help="Sim seconds")
+    parser.add_argument("--controller", choices=["bang_bang", "pid"])
+    parser.add_argument("--detector", choices=["contour", "scanline"])
+    parser.add_argument("--tracking", action="store_true")
+    parser.add_argument("--fps", type=float, help="Camera frame rate")
+    parser.add_argument("--noise", type=float, default=8, help="Pixel noise std dev")
+    parser.add_argument(
+        "--lighting", type=float, default=0.2, help="Brightness variation, 0-1"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    Config.CONTROLLER = args.controller or Config.CONTROLLER
+    Config.DETECTOR_MODE = args.detector or Config.DETECTOR_MODE
+    Config.TRACKING_ENABLED = args.tracking or Config.TRACKING_ENABLED
+    Config.CAMERA_FPS = args.fps or Config.CAMERA_FPS
+
+    result = simulate(args.laps, args.time_limit, args.noise, args.lighting, args.seed)
+    laps = ", ".join(f"{lap:.1f} s" for lap in result.lap_times) or "none"
+    print(f"Outcome:       {result.outcome}")
+    print(f"Lap times:     {laps}")
+    print(
+        f"Sim time:      {result.sim_time:.1f} s in {result.wall_time:.2f} s "
+        f"({result.sim_time / result.wall_time:.0f}x realtime)"
+    )
+    print(
+        f"Cross-track:   mean {result.mean_error * 1000:.1f} mm, "
+        f"rms {result.rms_error * 1000:.1f} mm, max {result.max_error * 1000:.1f} mm"
+    )
+    print(
+        f"Line lost:     {result.lost_frames}/{result.frames} frames, "
+        f"{result.loss_events} times"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import threading
+from collections import namedtuple
+
+
+# Published once per frame by the render stage. metrics is a new dict every
+# time and is never modified afterwards. The images stay in
+# Config.frame_stream and Config.thresh_stream.
+FrameSnapshot = namedtuple("FrameSnapshot", "seq timestamp metrics")
+
+# Operator input. In auto mode the manual speeds are kept for next time.
+MODES = ("auto", "manual")
+ControlInput = namedtuple("ControlInput", "mode left_speed right_speed")
+
+
+# Latest-value cell for immutable objects. Publishing swaps one reference, so
+# readers take a consistent value with a plain attribute read and never hold
+# anything the writer needs. The condition is only for readers that sleep
+# until the next value, and they hold it just long enough to compare versions.
+class Published:
+    def __init__(self, value):
+        self.current = value
+        self.version = 0
+        self._changed = threading.Condition()
+
+    def publish(self, value):
+        with self._changed:
+            self.current = value
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, version, timeout=None):
+        # Returns (version, value) once version has moved on, or on timeout
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version, self.current
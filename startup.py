@@ -0,0 +1,50 @@
+import threading
+import time
+
+# Imported first thing by main, so this is as close to process start as
+# Python gets without help from the OS
+STARTED = time.monotonic()
+
+
+# How long each part of startup took, for /health and /ready. Phases can
+# overlap; start and end are seconds since STARTED. Ready means the control
+# loop has sent the motors a command based on a camera frame.
+class Startup:
+    lock = threading.Lock()
+    phases = {}  # name -> [start, end], end None while running
+    ready_at = None
+
+    @staticmethod
+    def run(name, func, *args):
+        # Calls func(*args) as the phase called name and returns its result
+        start = time.monotonic() - STARTED
+        with Startup.lock:
+            Startup.phases[name] = [start, None]
+        try:
+            return func(*args)
+        finally:
+            Startup.phases[name][1] = time.monotonic() - STARTED
+
+    @staticmethod
+    def mark_ready():
+        with Startup.lock:
+            if Startup.ready_at is None:
+                Startup.ready_at = time.monotonic() - STARTED
+
+    @staticmethod
+    def report():
+        with Startup.lock:
+            phases = {
+                name: {
+                    "start": start,
+                    "end": end,
+                    "seconds": None if end is None else end - start,
+                }
+                for name, (start, end) in Startup.phases.items()
+            }
+        return {
+            "ready": Startup.ready_at is not None,
+            "uptime": time.monotonic() - STARTED,
+            "first_motor_command": Startup.ready_at,
+            "phases": phases,
+        }
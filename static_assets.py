@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import namedtuple
+
+from config import Config
+
+# One file, ready to send. bodies maps a Content-Encoding ("identity",
+# "gzip", "br") to its bytes; compressed copies are only kept if smaller.
+Asset = namedtuple("Asset", "mtime size etag content_type bodies")
+
+
+# Dashboard files, read and compressed once instead of on every request.
+# Each request costs one stat(); a file is only read again once its mtime
+# or size changes, so editing a template shows up on the next reload.
+class StaticAssets:
+    def __init__(self, root=None):
+        self.root = root or os.path.dirname(os.path.abspath(__file__))
+        self.directories = [
+            os.path.join(self.root, name) for name in Config.STATIC_DIRS
+        ]
+        self.assets = {}  # File path -> Asset
+        self.lock = threading.Lock()
+
+        self.encoders = {"gzip": lambda data: gzip.compress(data, 9, mtime=0)}
+        try:
+            import brotli
+
+            self.encoders["br"] = lambda data: brotli.compress(data, quality=11)
+        except ImportError:
+            pass
+
+        for directory in self.directories:
+            for dirpath, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    self.get(os.path.join(dirpath, filename))
+
+    def resolve(self, url_path):
+        # "/" is the dashboard, "/static/..." anything under static/
+        if url_path == "/":
+            path = os.path.join(self.root, "templates", "index.html")
+        elif url_path.startswith("/static/"):
+            path = os.path.join(self.root, "static", url_path[len("/static/") :])
+        else:
+            return None
+        path = os.path.realpath(path)
+        # Nothing outside the asset directories, however the path is spelled
+        if not any(
+            path.startswith(os.path.realpath(directory) + os.sep)
+            for directory in self.directories
+        ):
+            return None
+        return path
+
+    def get(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        version = (stat.st_mtime_ns, stat.st_size)
+        asset = self.assets.get(path)
+        if asset is not None and (asset.mtime, asset.size) == version:
+            return asset
+
+        # One thread rereads a changed file; the rest wait and reuse it
+        with self.lock:
+            asset = self.assets.get(path)
+            if asset is None or (asset.mtime, asset.size) != version:
+                asset = self.load(path, stat)
+                self.assets[path] = asset
+        return asset
+
+    def load(self, path, stat):
+        with open(path, "rb") as f:
+            data = f.read()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type.endswith(
+            ("javascript", "json", "svg+xml")
+        ):
+            content_type += "; charset=utf-8"
+
+        bodies = {"identity": data}
+        for encoding, compress in self.encoders.items():
+            compressed = compress(data)
+            if len(compressed) < len(data):
+                bodies[encoding] = compressed
+
+        digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+        return Asset(stat.st_mtime_ns, stat.st_size, digest, content_type, bodies)
+
+    @staticmethod
+    def choose_encoding(asset, accept_encoding):
+        # Smallest body the client accepts; q=0 rules an encoding out
+        accepted = set()
+        for item in (accept_encoding or "").split(","):
+            name, _, params = item.strip().partition(";")
+            quality = params.strip().partition("q=")[2]
+            try:
+                if quality and float(quality) == 0:
+                    continue
+            except ValueError:
+                continue
+            accepted.add(name.strip().lower())
+
+        candidates = [
+            encoding
+            for encoding in asset.bodies
+            if encoding != "identity" and (encoding in accepted or "*" in accepted)
+        ]
+        if not candidates:
+            return "identity"
+        return min(candidates, key=lambda encoding: len(asset.bodies[encoding]))
@@ -0,0 +1,114 @@
+import math
+import threading
+
+import numpy as np
+from snapshot import MODES
+
+
+# NaN marks "no value" in the float fields
+TELEMETRY_DTYPE = np.dtype(
+    [
+        ("seq", np.uint32),
+        ("timestamp", np.float64),
+        ("line_position", np.float32),
+        ("error", np.float32),
+        ("confidence", np.float32),
+        ("left_speed", np.int16),
+        ("right_speed", np.int16),
+        ("threshold", np.uint8),
+        ("mode", np.uint8),
+        ("capture_ms", np.float32),
+        ("detect_ms", np.float32),
+        ("render_ms", np.float32),
+    ]
+)
+
+
+def mode_code(mode):
+    # Index into MODES for the uint8 field; anything else is recorded as auto
+    return MODES.index(mode) if mode in MODES else 0
+
+
+# Fixed-size per-frame history. The buffer is allocated once; recording a
+# frame writes one row in place.
+class TelemetryRing:
+    def __init__(self, size):
+        self.buffer = np.zeros(size, dtype=TELEMETRY_DTYPE)
+        self.size = size
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def record(
+        self,
+        seq,
+        timestamp,
+        line_position,
+        error,
+        confidence,
+        left_speed,
+        right_speed,
+        threshold,
+        mode,
+        capture_ms,
+        detect_ms,
+    ):
+        with self.lock:
+            self.buffer[self.count % self.size] = (
+                seq,
+                timestamp,
+                math.nan if line_position is None else line_position,
+                math.nan if error is None else error,
+                confidence,
+                left_speed,
+                right_speed,
+                threshold,
+                mode_code(mode),
+                capture_ms,
+                detect_ms,
+                math.nan,
+            )
+            self.count += 1
+
+    def set_render_time(self, seq, render_ms):
+        # Rendering finishes after the row is written, if it happens at all
+        with self.lock:
+            for back in range(1, min(self.count, self.size) + 1):
+                index = (self.count - back) % self.size
+                row_seq = self.buffer["seq"][index]
+                if row_seq == seq:
+                    self.buffer["render_ms"][index] = render_ms
+                    return
+                if row_seq < seq:
+                    return
+
+    @property
+    def latest_seq(self):
+        with self.lock:
+            if not self.count:
+                return 0
+            return int(self.buffer[(self.count - 1) % self.size]["seq"])
+
+    def since(self, seq):
+        # Rows newer than seq, oldest first, as a copy
+        with self.lock:
+            if self.count <= self.size:
+                rows = self.buffer[: self.count].copy()
+            else:
+                start = self.count % self.size
+                rows = np.concatenate((self.buffer[start:], self.buffer[:start]))
+        return rows[rows["seq"] > seq]
+
+    @staticmethod
+    def to_columns(rows):
+        columns = {}
+        for name in TELEMETRY_DTYPE.names:
+            values = rows[name]
+            if name == "mode":
+                columns[name] = [MODES[value] for value in values]
+            elif values.dtype.kind == "f":
+                columns[name] = [
+                    None if math.isnan(value) else value for value in values.tolist()
+                ]
+            else:
+                columns[name] = values.tolist()
+        return columns
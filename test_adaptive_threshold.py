@@ -0,0 +1,30 @@
+import cv2
+import numpy as np
+import pytest
+
+from adaptive_threshold import AdaptiveThreshold
+from config import Config
+
+
+def floor_with_line(width=320, height=80, line_width=16, seed=0):
+    # A light floor with a dark tape line, about 5% of the view
+    rng = np.random.default_rng(seed)
+    gray = np.full((height, width), 200, dtype=np.int16)
+    gray[:, width // 2 - line_width // 2 : width // 2 + line_width // 2] = 30
+    gray += rng.integers(-10, 10, gray.shape, dtype=np.int16)
+    return np.clip(gray, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("mode", ["otsu", "percentile"])
+def test_adaptive_modes_keep_the_line(monkeypatch, mode):
+    monkeypatch.setattr(Config, "THRESHOLD_MODE", mode)
+    thresholder = AdaptiveThreshold()
+    for seed in range(Config.HISTOGRAM_UPDATE_INTERVAL * 5):
+        gray = floor_with_line(seed=seed)
+        value = thresholder.update(gray)
+
+    _, thresh = cv2.threshold(gray, value, 255, cv2.THRESH_BINARY_INV)
+    line = thresh[:, 160 - 8 : 160 + 8]
+    floor = np.concatenate((thresh[:, : 160 - 8], thresh[:, 160 + 8 :]), axis=1)
+    assert (line == 255).mean() > 0.99
+    assert (floor == 255).mean() < 0.01
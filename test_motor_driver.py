@@ -0,0 +1,88 @@
+import motor_driver
+from config import Config
+from motor_driver import SimulatedMotorDriver
+
+PERIOD = 1.0 / Config.CONTROL_RATE_HZ
+STEP = Config.MOTOR_SLEW_RATE * PERIOD
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_driver(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(motor_driver.time, "monotonic", clock)
+    return SimulatedMotorDriver(), clock
+
+
+def run(driver, clock, left, right, ticks):
+    for _ in range(ticks):
+        # A hair over a period, so float rounding can't trip the write limit
+        clock.now += PERIOD * 1.001
+        driver.command(left, right)
+
+
+def test_slews_from_rest(monkeypatch):
+    driver, clock = make_driver(monkeypatch)
+    run(driver, clock, 100, 100, 1)
+    assert (driver.left_speed, driver.right_speed) == (STEP, STEP)
+    run(driver, clock, 100, 100, 2)
+    assert (driver.left_speed, driver.right_speed) == (3 * STEP, 3 * STEP)
+    run(driver, clock, 100, 100, 50)
+    assert (driver.left_speed, driver.right_speed) == (100, 100)
+
+
+def test_reverses_gradually_after_a_hold(monkeypatch):
+    driver, clock = make_driver(monkeypatch)
+    run(driver, clock, 50, 50, 50)
+    assert driver.left_speed == 50
+    # Held for a second: the next command still only moves one step
+    clock.now += 1.0
+    driver.command(-50, -50)
+    assert driver.left_speed == 50 - STEP
+    run(driver, clock, -50, -50, 50)
+    assert driver.left_speed == -50
+    lefts = [left for _, left, _ in driver.history]
+    assert all(abs(b - a) <= STEP for a, b in zip(lefts, lefts[1:]))
+
+
+def test_skips_unchanged_commands(monkeypatch):
+    driver, clock = make_driver(monkeypatch)
+    run(driver, clock, 40, 40, 20)
+    writes = driver.writes
+    run(driver, clock, 40, 40, 10)
+    assert driver.writes == writes
+    assert driver.coalesced >= 10
+
+
+def test_limits_write_rate(monkeypatch):
+    driver, clock = make_driver(monkeypatch)
+    run(driver, clock, 100, 100, 1)
+    # Commands faster than MOTOR_MIN_WRITE_INTERVAL aren't all written
+    for _ in range(4):
+        clock.now += Config.MOTOR_MIN_WRITE_INTERVAL / 5
+        driver.command(100, 100)
+    assert driver.writes == 1
+    assert driver.rate_limited == 4
+    # The output kept slewing meanwhile, so the next write catches up
+    clock.now += Config.MOTOR_MIN_WRITE_INTERVAL
+    driver.command(100, 100)
+    assert driver.writes == 2
+    assert driver.left_speed > 2 * STEP
+
+
+def test_stop_goes_straight_through(monkeypatch):
+    driver, clock = make_driver(monkeypatch)
+    run(driver, clock, 100, 100, 50)
+    clock.now += Config.MOTOR_MIN_WRITE_INTERVAL / 10
+    assert driver.command(0, 0)
+    assert (driver.left_speed, driver.right_speed) == (0, 0)
+    assert driver.history[-1][1:] == (0, 0)
+    # And it restarts from rest, not from where it stopped
+    run(driver, clock, 100, 100, 1)
+    assert driver.left_speed == STEP
@@ -0,0 +1,44 @@
+from config import Config
+from robot_controller import PIDController, RobotController
+
+WIDTH = 320
+DT = 1.0 / 50
+
+
+def run_pid(pid, line_pos_x, ticks):
+    speeds = None
+    for _ in range(ticks):
+        speeds = RobotController.calculate_pid_speeds(pid, WIDTH, line_pos_x, DT)
+    return speeds
+
+
+def test_pid_recovers_after_saturating():
+    pid = PIDController()
+    # The line far to the left for 5 s: one wheel stops, the other runs at 2x
+    centre = WIDTH / 2
+    assert run_pid(pid, centre - 150, 250) == (0, 2 * Config.STRAIGHT_SPEED)
+    assert pid.integral < Config.PID_INTEGRAL_LIMIT / 10
+
+    # Back on the line, it drives straight again straight away
+    assert run_pid(pid, centre, 2) == (Config.STRAIGHT_SPEED, Config.STRAIGHT_SPEED)
+
+
+def test_pid_integral_still_unwinds_while_saturated():
+    pid = PIDController()
+    pid.integral = Config.PID_INTEGRAL_LIMIT
+    run_pid(pid, WIDTH / 2 - 150, 10)
+    assert pid.integral <= Config.PID_INTEGRAL_LIMIT
+    run_pid(pid, WIDTH / 2 + 150, 10)
+    assert pid.integral < Config.PID_INTEGRAL_LIMIT
+
+
+def test_new_track_runs_at_full_speed():
+    # A fresh track's confidence is TRACKING_ALPHA, well short of 1
+    speeds = RobotController.calculate_motor_speeds(
+        WIDTH, WIDTH / 2, Config.TRACKING_ALPHA
+    )
+    assert speeds == (Config.STRAIGHT_SPEED, Config.STRAIGHT_SPEED)
+    slow = RobotController.calculate_motor_speeds(
+        WIDTH, WIDTH / 2, Config.TRACKING_SLOW_CONFIDENCE / 2
+    )
+    assert slow[0] < Config.STRAIGHT_SPEED
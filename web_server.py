@@ -1,66 +1,425 @@
-import cv2
-import os
 import json
-from http.server import BaseHTTPRequestHandler
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 from config import Config
+from perf import Perf
+from snapshot import MODES, ControlInput
+from startup import Startup
+from static_assets import StaticAssets
+from websocket import WebSocket, accept_key
+
+
+def apply_control_input(data):
+    # Built whole and swapped in; the control loop reads it without a lock.
+    # Raises ValueError on anything the control loop couldn't use.
+    mode = data.get("mode")
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    if mode == "manual":
+        speeds = [data.get("left_speed"), data.get("right_speed")]
+        if not all(
+            isinstance(speed, (int, float)) and not isinstance(speed, bool)
+            for speed in speeds
+        ):
+            raise ValueError("left_speed and right_speed must be numbers")
+        left_speed, right_speed = (
+            min(max(speed, -Config.MAX_SPEED), Config.MAX_SPEED) for speed in speeds
+        )
+        control = ControlInput("manual", left_speed, right_speed)
+    else:
+        control = Config.control.current._replace(mode=mode)
+    Config.control.publish(control)
+
+
+class RobotHTTPServer(ThreadingHTTPServer):
+    # Thread per connection, capped at MAX_CONNECTIONS. Image routes share a
+    # smaller pool of MAX_MEDIA_WORKERS slots, so the remaining connections
+    # are always free for /control and /metrics.
+    def __init__(self, server_address, handler_class):
+        super().__init__(server_address, handler_class)
+        self.connection_slots = threading.BoundedSemaphore(Config.MAX_CONNECTIONS)
+        self.media_slots = threading.BoundedSemaphore(Config.MAX_MEDIA_WORKERS)
+        self.assets = StaticAssets()
+
+    def process_request(self, request, client_address):
+        if not self.connection_slots.acquire(blocking=False):
+            try:
+                request.sendall(
+                    b"HTTP/1.1 503 Service Unavailable\r\n"
+                    b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.connection_slots.release()
 
 
 class StreamingHandler(BaseHTTPRequestHandler):
+    # Keep-alive, with idle and stalled connections dropped after a timeout
+    protocol_version = "HTTP/1.1"
+    timeout = Config.KEEP_ALIVE_TIMEOUT
+    disable_nagle_algorithm = True
+
     def do_GET(self):
-        if self.path == "/":
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html")
+        if self.path == "/" or self.path.startswith("/static/"):
+            self.send_asset()
+
+        elif self.path.startswith("/frame"):
+            self.serve_media(self.send_jpeg, Config.frame_stream)
+
+        elif self.path.startswith("/threshold"):
+            self.serve_media(self.send_jpeg, Config.thresh_stream)
+
+        elif self.path.startswith("/mask"):
+            self.serve_media(self.send_mask, Config.thresh_stream)
+
+        elif self.path.startswith("/raw"):
+            self.serve_media(self.send_jpeg, Config.raw_stream)
+
+        elif self.path.startswith("/stream"):
+            query = parse_qs(urlparse(self.path).query)
+            view = query.get("view", ["frame"])[0]
+            if view == "threshold":
+                self.serve_media(self.stream_mjpeg, Config.thresh_stream)
+            elif view == "frame":
+                self.serve_media(self.stream_mjpeg, Config.frame_stream)
+            elif view == "raw":
+                # The dashboard draws the overlay itself from metrics["overlay"]
+                self.serve_media(self.stream_mjpeg, Config.raw_stream)
+            else:
+                self.send_error(404, f"Unknown view: {view}")
+
+        elif self.path == "/ws":
+            self.serve_websocket()
+
+        elif self.path == "/recorder":
+            self.serve_recorder()
+
+        elif self.path.startswith("/metrics/perf"):
+            query = parse_qs(urlparse(self.path).query)
+            if query.get("format", ["json"])[0] == "prometheus":
+                body = Perf.prometheus().encode()
+                self.send_body(body, "text/plain; version=0.0.4")
+            else:
+                self.send_body(json.dumps(Perf.report()).encode(), "application/json")
+
+        elif self.path.startswith("/metrics/history"):
+            self.send_history()
+
+        elif self.path == "/health":
+            self.send_body(json.dumps(Startup.report()).encode(), "application/json")
+
+        elif self.path == "/ready":
+            # 503 until the robot is driving on camera frames
+            report = Startup.report()
+            body = json.dumps(report).encode()
+            self.send_body(body, "application/json", 200 if report["ready"] else 503)
+
+        elif self.path == "/metrics":
+            body = json.dumps(Config.state.current.metrics).encode()
+            self.send_body(body, "application/json")
+
+        else:
+            self.send_error(404)
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_asset(self):
+        assets = self.server.assets
+        path = assets.resolve(urlparse(self.path).path)
+        asset = path and assets.get(path)
+        if not asset:
+            self.send_error(404)
+            return
+
+        encoding = assets.choose_encoding(asset, self.headers.get("Accept-Encoding"))
+        etag = f'"{asset.etag}-{encoding}"'
+        if Config.STATIC_MAX_AGE:
+            cache_control = f"max-age={Config.STATIC_MAX_AGE}"
+        else:
+            cache_control = "no-cache"
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
             self.end_headers()
+            return
 
-            # Load the HTML template
-            template_path = os.path.join(
-                os.path.dirname(__file__), "templates", "index.html"
-            )
-            with open(template_path, "r") as f:
-                template = f.read()
+        body = asset.bodies[encoding]
+        self.send_response(200)
+        self.send_header("Content-Type", asset.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        self.wfile.write(body)
 
-            self.wfile.write(template.encode())
+    def send_history(self):
+        url = urlparse(self.path)
+        try:
+            since = int(parse_qs(url.query).get("since", ["0"])[0])
+        except ValueError:
+            self.send_error(400, "since must be an integer")
+            return
 
-        elif self.path.startswith("/frame"):
+        if Config.telemetry is None:
+            self.send_error(503, "Starting up")
+            return
+        rows = Config.telemetry.since(since)
+        latest = int(rows["seq"][-1]) if len(rows) else since
+
+        if url.path == "/metrics/history.bin":
+            # Raw rows; the dtype header is enough for np.frombuffer
             self.send_response(200)
-            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(rows.nbytes))
+            self.send_header("X-Telemetry-Dtype", json.dumps(rows.dtype.descr))
+            self.send_header("X-Telemetry-Seq", str(latest))
             self.end_headers()
-            with Config.frame_lock:
-                if Config.latest_frame is not None:
-                    _, jpeg = cv2.imencode(".jpg", Config.latest_frame)
-                    self.wfile.write(jpeg.tobytes())
+            self.wfile.write(rows.tobytes())
+        elif url.path == "/metrics/history":
+            body = json.dumps(
+                {"seq": latest, "rows": Config.telemetry.to_columns(rows)}
+            )
+            self.send_body(body.encode(), "application/json")
+        else:
+            self.send_error(404)
 
-        elif self.path.startswith("/threshold"):
-            self.send_response(200)
-            self.send_header("Content-Type", "image/jpeg")
+    def serve_media(self, send, channel):
+        if not self.server.media_slots.acquire(timeout=Config.MEDIA_SLOT_TIMEOUT):
+            self.send_error(503, "Too many viewers")
+            return
+        try:
+            send(channel)
+        finally:
+            self.server.media_slots.release()
+
+    def send_jpeg(self, channel):
+        # Views nobody was watching aren't being produced, so wait for the
+        # frame this request triggers rather than serve a stale one
+        if not channel.is_watched(Config.VIEWER_TIMEOUT):
+            channel.wait_for_frame(channel.seq, timeout=1.0)
+
+        # Pollers that already have the current frame get a 304 without
+        # the frame ever being encoded
+        channel.touch()
+        etag = channel.etag(channel.seq)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
             self.end_headers()
-            with Config.thresh_lock:
-                if Config.latest_thresh is not None:
-                    thresh_color = cv2.cvtColor(
-                        Config.latest_thresh, cv2.COLOR_GRAY2BGR
-                    )
-                    _, jpeg = cv2.imencode(".jpg", thresh_color)
-                    self.wfile.write(jpeg.tobytes())
+            return
 
-        elif self.path == "/metrics":
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
+        seq, jpeg = channel.get_jpeg()
+        if jpeg is None:
+            self.send_response(204)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(jpeg)))
+        self.send_header("ETag", channel.etag(seq))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(jpeg)
+
+    def send_mask(self, channel):
+        # The threshold view as a bare binary mask, packed one bit per pixel
+        # ("bits") or as run lengths ("rle"), optionally just the search area.
+        # Long-polls for a mask newer than since, like the MJPEG stream.
+        from mask_encoding import MASK_ENCODERS
+
+        query = parse_qs(urlparse(self.path).query)
+        encoding = query.get("encoding", ["bits"])[0]
+        if encoding not in MASK_ENCODERS:
+            self.send_error(400, f"Unknown encoding: {encoding}")
+            return
+        try:
+            since = int(query.get("since", ["0"])[0])
+        except ValueError:
+            self.send_error(400, "since must be an integer")
+            return
+
+        channel.wait_for_frame(since, timeout=1.0)
+        seq, mask = channel.get_image()
+        if mask is None:
+            self.send_response(204)
             self.end_headers()
-            with Config.metrics_lock:
-                self.wfile.write(json.dumps(Config.latest_metrics).encode())
+            return
+        if query.get("roi", ["0"])[0] == "1":
+            mask = mask[: mask.shape[0] // Config.SEARCH_HEIGHT_RATIO]
+
+        body = MASK_ENCODERS[encoding](mask)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Mask-Encoding", encoding)
+        self.send_header("X-Mask-Width", str(mask.shape[1]))
+        self.send_header("X-Mask-Height", str(mask.shape[0]))
+        self.send_header("X-Mask-Seq", str(seq))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_mjpeg(self, channel):
+        boundary = Config.STREAM_BOUNDARY.encode()
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header(
+            "Content-Type",
+            f"multipart/x-mixed-replace; boundary={Config.STREAM_BOUNDARY}",
+        )
+        self.send_header("Cache-Control", "no-cache, private")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        last_seq = 0
+        try:
+            while True:
+                if channel.wait_for_frame(last_seq, timeout=1.0) == last_seq:
+                    continue
+                last_seq, jpeg = channel.get_jpeg()
+                if jpeg is None:
+                    continue
+                self.wfile.write(
+                    b"--%s\r\n"
+                    b"Content-Type: image/jpeg\r\n"
+                    b"Content-Length: %d\r\n\r\n" % (boundary, len(jpeg))
+                )
+                self.wfile.write(jpeg)
+                self.wfile.write(b"\r\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            # Viewer went away or stalled past the timeout
+            pass
+
+    def serve_websocket(self):
+        # One socket carrying control input in and metrics out, so the
+        # dashboard doesn't pay for a new request every 50 ms
+        key = self.headers.get("Sec-WebSocket-Key")
+        if self.headers.get("Upgrade", "").lower() != "websocket" or not key:
+            self.send_error(400, "Expected a WebSocket upgrade")
+            return
+
+        self.close_connection = True
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept_key(key))
+        self.end_headers()
+
+        ws = WebSocket(self.connection, self.rfile)
+        pusher = threading.Thread(target=self.push_metrics, args=(ws,), daemon=True)
+        pusher.start()
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                # Anything malformed, bad UTF-8 included, is ignored; the
+                # socket stays open
+                try:
+                    data = json.loads(message)
+                    if isinstance(data, dict) and data.get("type") == "control":
+                        apply_control_input(data)
+                except ValueError:
+                    pass
+        except (ConnectionError, TimeoutError, ValueError):
+            pass
+        finally:
+            ws.close()
+
+    def push_metrics(self, ws):
+        last_version = None
+        last_ping = time.monotonic()
+        try:
+            while not ws.closed:
+                version, snapshot = Config.state.wait(
+                    last_version, timeout=Config.WS_PING_INTERVAL
+                )
+                if version != last_version:
+                    last_version = version
+                    ws.send_text(
+                        json.dumps({"type": "metrics", "data": snapshot.metrics})
+                    )
+                if time.monotonic() - last_ping >= Config.WS_PING_INTERVAL:
+                    ws.ping()
+                    last_ping = time.monotonic()
+        except OSError:
+            ws.abort()
+
+    def serve_recorder(self, action=None):
+        recorder = Config.recorder
+        if recorder is None:
+            self.send_error(503, "Recorder not running")
+            return
+
+        body = {"status": "ok"}
+        if action == "start":
+            recorder.recording = True
+        elif action == "stop":
+            recorder.recording = False
+        elif action == "snapshot":
+            content_length = int(self.headers.get("Content-Length", 0))
+            try:
+                data = json.loads(self.rfile.read(content_length) or b"{}")
+                if not isinstance(data, dict):
+                    raise ValueError("Expected a JSON object")
+                seconds = data.get("seconds")
+                if seconds is not None and not (
+                    isinstance(seconds, (int, float))
+                    and not isinstance(seconds, bool)
+                    and 0 < seconds < math.inf
+                ):
+                    raise ValueError("seconds must be a positive number")
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            path = recorder.snapshot(seconds)
+            if path is None:
+                self.send_error(503, "Recorder busy")
+                return
+            body["snapshot"] = path
+
+        body["recorder"] = recorder.stats()
+        self.send_body(json.dumps(body).encode(), "application/json")
 
     def do_POST(self):
         if self.path == "/control":
-            content_length = int(self.headers["Content-Length"])
-            post_data = json.loads(self.rfile.read(content_length))
+            content_length = int(self.headers.get("Content-Length", 0))
+            try:
+                post_data = json.loads(self.rfile.read(content_length))
+                if not isinstance(post_data, dict):
+                    raise ValueError("Expected a JSON object")
+                apply_control_input(post_data)
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
 
-            with Config.controller_lock:
-                Config.control_mode = post_data["mode"]
-                if Config.control_mode == "manual":
-                    Config.manual_left_speed = post_data["left_speed"]
-                    Config.manual_right_speed = post_data["right_speed"]
+            self.send_body(json.dumps({"status": "ok"}).encode(), "application/json")
 
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"status": "ok"}).encode())
+        elif self.path in ("/recorder/start", "/recorder/stop", "/recorder/snapshot"):
+            self.serve_recorder(self.path.rsplit("/", 1)[1])
+
+        else:
+            self.send_error(404)
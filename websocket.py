@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import socket
+import struct
+import threading
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_MESSAGE_SIZE = 64 * 1024
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def accept_key(key):
+    digest = hashlib.sha1((key + GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+def _unmask(payload, mask):
+    repeated = (mask * (len(payload) // 4 + 1))[: len(payload)]
+    unmasked = int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")
+    return unmasked.to_bytes(len(payload), "big")
+
+
+# Minimal server side of RFC 6455: enough for the dashboard's small JSON
+# messages, no extensions or subprotocols
+class WebSocket:
+    def __init__(self, sock, rfile):
+        self.sock = sock
+        self.rfile = rfile
+        self.closed = False
+        self._send_lock = threading.Lock()
+
+    def _read_exact(self, size):
+        data = self.rfile.read(size)
+        if len(data) < size:
+            raise ConnectionError("WebSocket closed by peer")
+        return data
+
+    def receive(self):
+        # Returns the payload of the next text/binary message, or None once
+        # closed. Text is left undecoded, so bad UTF-8 is the caller's to skip
+        fragments = []
+        size = 0
+        while True:
+            first, second = self._read_exact(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                (length,) = struct.unpack("!H", self._read_exact(2))
+            elif length == 127:
+                (length,) = struct.unpack("!Q", self._read_exact(8))
+
+            size += length
+            if size > MAX_MESSAGE_SIZE:
+                raise ConnectionError("WebSocket message too large")
+            if not second & 0x80:
+                raise ConnectionError("Unmasked client frame")
+
+            mask = self._read_exact(4)
+            payload = _unmask(self._read_exact(length), mask)
+
+            if opcode == OP_CLOSE:
+                self.close()
+                return None
+            if opcode == OP_PING:
+                self.send(OP_PONG, payload)
+                continue
+            if opcode == OP_PONG:
+                continue
+
+            fragments.append(payload)
+            if first & 0x80:
+                return b"".join(fragments)
+
+    def send(self, opcode, payload=b""):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+
+        with self._send_lock:
+            self.sock.sendall(header + payload)
+
+    def send_text(self, text):
+        self.send(OP_TEXT, text.encode())
+
+    def ping(self):
+        self.send(OP_PING)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.send(OP_CLOSE)
+        except OSError:
+            pass
+
+    def abort(self):
+        # Unblocks a reader stuck in receive()
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
@@ -0,0 +1,248 @@
+import itertools
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+from config import Config
+from frame_channel import encode_jpeg
+from image_processor import ImageProcessor, LineData
+
+
+def worker_main(tasks, results, settings):
+    # Ctrl-C reaches the whole process group; the parent decides when we stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name, value in settings.items():
+        setattr(Config, name, value)
+
+    blocks = {}
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        kind, key, name, shape, dtype, args = task
+        if name not in blocks:
+            # Spawned workers report to the parent's resource tracker, so
+            # attaching here doesn't make the block ours to unlink
+            blocks[name] = shared_memory.SharedMemory(name=name)
+        image = np.ndarray(shape, dtype, buffer=blocks[name].buf)
+
+        try:
+            if kind == "detect":
+                start = time.perf_counter()
+                line_data = ImageProcessor.find_line(image, *args)
+                detect_ms = (time.perf_counter() - start) * 1000
+                # The threshold image is only needed in here
+                result = (line_data._replace(thresh=None), detect_ms)
+            else:
+                result = encode_jpeg(image)
+        except Exception as e:
+            result = e
+        del image
+        results.put((kind, key, name, result))
+
+    for block in blocks.values():
+        block.close()
+
+
+# Runs detection and JPEG encoding in PROCESS_WORKERS processes, away from
+# the GIL. Images travel through a fixed pool of shared memory slots: one
+# copy in, nothing pickled but the slot name. Detection results come back
+# in the order frames were submitted, whichever worker finishes first.
+class FrameWorkers:
+    def __init__(self, count=None, slots=None):
+        self.count = count or Config.PROCESS_WORKERS
+        self.slot_count = slots or self.count * 2
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        # Spawned workers start from a fresh import, so hand over settings
+        settings = {
+            name: value for name, value in vars(Config).items() if name.isupper()
+        }
+        self.processes = [
+            context.Process(
+                target=worker_main,
+                args=(self.tasks, self.results, settings),
+                name=f"worker-{i}",
+                daemon=True,
+            )
+            for i in range(self.count)
+        ]
+        self.collector = threading.Thread(
+            target=self._collect, name="worker-results", daemon=True
+        )
+
+        # Slots are allocated on first use, once the frame size is known
+        self.blocks = {}
+        self.free = queue.Queue()
+        self.allocate_lock = threading.Lock()
+
+        self.condition = threading.Condition()
+        self.order = deque()  # Detection seqs in submission order
+        self.pending = {}  # seq -> CapturedFrame awaiting its result
+        self.done = {}  # seq -> (line_data, detect_ms), possibly out of order
+        self.encodes = {}  # key -> [event, jpeg]
+        self.keys = itertools.count()
+        self.closed = False
+        self.completed = 0
+        self.dropped = 0
+        self.lost = 0
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        self.collector.start()
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+        self.results.put(None)
+        self.collector.join(timeout=2)
+        for waiter in list(self.encodes.values()):
+            waiter[0].set()
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+
+    def _allocate(self, image):
+        with self.allocate_lock:
+            if self.blocks:
+                return
+            height, width = image.shape[:2]
+            # Big enough for a frame or a 3-channel debug image of it
+            size = max(image.nbytes, height * width * 3)
+            for _ in range(self.slot_count):
+                block = shared_memory.SharedMemory(create=True, size=size)
+                self.blocks[block.name] = block
+                self.free.put(block.name)
+
+    def _put(self, kind, key, image, args=(), timeout=None):
+        # Copies image into a free slot and queues it; False if none is free
+        self._allocate(image)
+        try:
+            name = self.free.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        block = self.blocks[name]
+        if image.nbytes > block.size:
+            self.free.put(name)
+            return False
+        slot = np.ndarray(image.shape, image.dtype, buffer=block.buf)
+        slot[...] = image
+        del slot
+        self.tasks.put((kind, key, name, image.shape, image.dtype.str, args))
+        return True
+
+    def submit(self, captured, window=None, scale=1):
+        if self.closed:
+            return
+        with self.condition:
+            self.order.append(captured.seq)
+            self.pending[captured.seq] = captured
+        # All slots busy means the workers are behind; drop rather than queue
+        args = (window, scale, False)
+        if not self._put("detect", captured.seq, captured.frame, args, timeout=0.1):
+            with self.condition:
+                self.order.remove(captured.seq)
+                del self.pending[captured.seq]
+            self.dropped += 1
+
+    def next_result(self, timeout=None):
+        # The oldest submitted frame's result, once it's in. Frames whose
+        # result is overdue are given up on so later ones aren't held behind
+        # them, and a dead worker raises rather than leave the caller waiting.
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.closed or (self.order and self.order[0] in self.done),
+                timeout,
+            )
+            if self.closed:
+                return None
+            if not self.order or self.order[0] not in self.done:
+                self._check_workers()
+                self._drop_overdue()
+                return None
+            seq = self.order.popleft()
+            line_data, detect_ms = self.done.pop(seq)
+            self.completed += 1
+            return self.pending.pop(seq), line_data, detect_ms
+
+    def _check_workers(self):
+        for process in self.processes:
+            if not process.is_alive():
+                raise RuntimeError(
+                    f"{process.name} exited with code {process.exitcode}"
+                )
+
+    def _drop_overdue(self):
+        # Called with the condition held
+        now = time.monotonic()
+        while self.order and self.order[0] not in self.done:
+            seq = self.order[0]
+            if now - self.pending[seq].timestamp < Config.WORKER_RESULT_TIMEOUT:
+                break
+            self.order.popleft()
+            del self.pending[seq]
+            self.lost += 1
+
+    def encode_jpeg(self, image):
+        if self.closed:
+            return encode_jpeg(image)
+        key = next(self.keys)
+        waiter = self.encodes[key] = [threading.Event(), None]
+        if not self._put("encode", key, image, timeout=Config.MEDIA_SLOT_TIMEOUT):
+            del self.encodes[key]
+            return encode_jpeg(image)
+        waiter[0].wait(timeout=1.0)
+        del self.encodes[key]
+        return waiter[1] if waiter[1] is not None else encode_jpeg(image)
+
+    def _collect(self):
+        while True:
+            item = self.results.get()
+            if item is None:
+                return
+            kind, key, name, result = item
+            self.free.put(name)
+
+            if kind == "encode":
+                waiter = self.encodes.get(key)
+                if waiter is not None:
+                    waiter[1] = None if isinstance(result, Exception) else result
+                    waiter[0].set()
+                continue
+
+            if isinstance(result, Exception):
+                print(f"Detection failed in worker: {result}")
+                line_data = LineData(
+                    None, None, None, Config.THRESHOLD_VALUE, None, None, None, None
+                )
+                result = (line_data, 0.0)
+            with self.condition:
+                # Unless it was given up on while it was being worked on
+                if key in self.pending:
+                    self.done[key] = result
+                    self.condition.notify_all()
+
+    def stats(self):
+        return {
+            "processed": self.completed,
+            "dropped": self.dropped,
+            "lost": self.lost,
+            "in_flight": len(self.order),
+            "workers": sum(process.is_alive() for process in self.processes),
+        }